@@ -0,0 +1,118 @@
+"""Generator of synthetic commit histories for benchmarks
+
+History is written straight to main with bulk statements, the same way merges leave it:
+tables with columns are created first, then columns are altered and tables renamed until the
+requested number of commits is reached. A checkpoint is saved after every chunk, as after a merge.
+"""
+
+import logging
+import random
+from typing import Dict, List, NamedTuple
+
+from sqlalchemy.orm import Session
+
+from dbengine.methods import create_branch, get_branch
+from dbengine.methods.bulk import Change, allocate_ids, write_changes
+from dbengine.methods.checkpoint import load_branch_state, save_checkpoint
+from dbengine.models import AttributeTypes, Branch, DbAttributes, DbEntity
+
+logger = logging.getLogger(__name__)
+
+
+class History(NamedTuple):
+    """Objects of generated history"""
+
+    tables: List[int]
+    columns: Dict[int, List[int]]
+    branches: List[Branch]
+
+
+class _Generator:
+    def __init__(self, session: Session, seed: int):
+        self.session = session
+        self.random = random.Random(seed)
+        self.attributes: Dict[int, int] = {}
+        self.values: Dict[int, dict] = {}
+        self.tables: Dict[int, int] = {}
+
+    def create(self, type: AttributeTypes, entity_id: int, table_id: int, values: dict) -> Change:
+        self.values[entity_id] = values
+        if type == AttributeTypes.COLUMN:
+            self.tables[entity_id] = table_id
+        return Change(type, entity_id, table_id, attribute_out=values, new_entity=True)
+
+    def alter(self, entity_id: int) -> Change:
+        values = dict(self.values[entity_id])
+        if "datatype" in values:
+            values["datatype"] = "BIGINT" if values["datatype"] == "INTEGER" else "INTEGER"
+            type, table_id = AttributeTypes.COLUMN, self.tables[entity_id]
+        else:
+            values["name"] = f"{values['name'].split('__')[0]}__{self.random.randrange(10 ** 6)}"
+            type, table_id = AttributeTypes.TABLE, entity_id
+        self.values[entity_id] = values
+        return Change(type, entity_id, table_id, attribute_out=values)
+
+    def write(self, branch: Branch, changes: List[Change]) -> None:
+        """Write changes, attribute ids are allocated here so changes of one entity can follow each other"""
+        ids = iter(allocate_ids(DbAttributes, len(changes), session=self.session))
+        written = []
+        for change in changes:
+            attribute_out = dict(change.attribute_out, id=next(ids))
+            attribute_in = self.attributes.get(change.entity_id)
+            written.append(change._replace(attribute_in=attribute_in, attribute_out=attribute_out))
+            self.attributes[change.entity_id] = attribute_out["id"]
+        write_changes(branch, written, session=self.session)
+
+
+def generate(
+    session: Session,
+    *,
+    commits: int,
+    tables: int,
+    columns: int,
+    branches: int,
+    branch_commits: int,
+    chunk: int = 1000,
+    prefix: str = "bench",
+    seed: int = 0,
+) -> History:
+    """Write history of about `commits` commits on main with `tables` tables of `columns` columns
+    and `branches` open branches of `branch_commits` commits each
+    """
+    generator = _Generator(session, seed)
+    main = get_branch(1, session=session)
+    table_ids, column_ids, changes = [], {}, []
+    ids = iter(allocate_ids(DbEntity, tables * (columns + 1), session=session))
+    for number in range(tables):
+        table_id = next(ids)
+        table_ids.append(table_id)
+        changes.append(generator.create(AttributeTypes.TABLE, table_id, table_id, dict(name=f"{prefix}_{number}")))
+        column_ids[table_id] = []
+        for column in range(columns):
+            column_id = next(ids)
+            column_ids[table_id].append(column_id)
+            changes.append(
+                generator.create(
+                    AttributeTypes.COLUMN, column_id, table_id, dict(name=f"col_{column}", datatype="INTEGER")
+                )
+            )
+    entities = table_ids + [column_id for ids in column_ids.values() for column_id in ids]
+    while len(changes) < commits:
+        changes.append(generator.alter(generator.random.choice(entities)))
+    for start in range(0, len(changes), chunk):
+        generator.write(main, changes[start : start + chunk])
+        save_checkpoint(main.head_commit_id, load_branch_state(main.id, session=session), session=session)
+        session.flush()
+        logger.info("Written %d of %d commits", min(start + chunk, len(changes)), len(changes))
+
+    open_branches = []
+    for number in range(branches):
+        branch = create_branch(f"{prefix} branch {number}", session=session)
+        touched = generator.random.sample(entities, min(branch_commits, len(entities)))
+        attributes = dict(generator.attributes)
+        values = dict(generator.values)
+        generator.write(branch, [generator.alter(entity_id) for entity_id in touched])
+        # Branches don't change main, the next one starts from the same state
+        generator.attributes, generator.values = attributes, values
+        open_branches.append(branch)
+    return History(table_ids, column_ids, open_branches)
@@ -0,0 +1,207 @@
+"""Benchmarks of methods layer on synthetic history
+
+Usage: python -m benchmarks.run [--commits 10000] [--output results.json]
+
+History is generated in a scratch database BENCH_DB_DSN and migrations run against a scratch
+warehouse BENCH_DWH_TEST_DSN, both are required, DB_DSN and DWH connections from settings are never used.
+Merge is benchmarked only if BENCH_DWH_PROD_DSN is set to another scratch warehouse.
+Every benchmark reports wall time of its runs and number of SQL statements per run.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from pydantic import AnyUrl, parse_obj_as
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from dbengine.db_connector import CONNECTOR_DICT
+from dbengine.exceptions import BranchError
+from dbengine.methods import (
+    create_branch,
+    create_main_branch,
+    create_table,
+    get_branch,
+    get_schema,
+    get_table,
+    get_tables,
+    ok_branch,
+    request_merge_branch,
+)
+from dbengine.methods.branch import check_conflicts
+from dbengine.methods.column import get_columns
+from dbengine.models import Commit
+from dbengine.models.base import Base
+from .generate import generate
+
+logger = logging.getLogger(__name__)
+
+
+class StatementCounter:
+    """Count SQL statements sent by all engines"""
+
+    def __init__(self):
+        self.count = 0
+        event.listen(Engine, "before_cursor_execute", self)
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+def measure(name: str, func: Callable, counter: StatementCounter, runs: int, setup: Optional[Callable] = None) -> dict:
+    timings, statements = [], []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        count = counter.count
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        statements.append(counter.count - count)
+    result = dict(
+        name=name,
+        runs=runs,
+        min_s=min(timings),
+        median_s=statistics.median(timings),
+        max_s=max(timings),
+        statements=max(statements),
+    )
+    logger.info("%(name)s: median %(median_s).4fs, %(statements)d statements", result)
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commits", type=int, default=10_000, help="Commits on main")
+    parser.add_argument("--tables", type=int, default=1_000)
+    parser.add_argument("--columns", type=int, default=5, help="Columns per table")
+    parser.add_argument("--wide-columns", type=int, default=500, help="Columns of the wide table")
+    parser.add_argument("--branches", type=int, default=50, help="Open branches")
+    parser.add_argument("--branch-commits", type=int, default=20, help="Commits in every open branch")
+    parser.add_argument("--runs", type=int, default=5, help="Runs of every repeatable benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="File to write JSON results to, stdout by default")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if not os.environ.get("BENCH_DB_DSN"):
+        sys.exit("BENCH_DB_DSN is not set, point it at a scratch database to write synthetic history to")
+    if not os.environ.get("BENCH_DWH_TEST_DSN"):
+        sys.exit("BENCH_DWH_TEST_DSN is not set, point it at a scratch warehouse to run migrations in")
+    engine = create_engine(os.environ["BENCH_DB_DSN"])
+    Base.metadata.create_all(engine)
+    session = sessionmaker(engine, autocommit=True, autoflush=False)()
+    test_url = parse_obj_as(AnyUrl, os.environ["BENCH_DWH_TEST_DSN"])
+    test_connector = CONNECTOR_DICT[test_url.scheme](test_url)
+    prod_connector = None
+    if os.environ.get("BENCH_DWH_PROD_DSN"):
+        prod_url = parse_obj_as(AnyUrl, os.environ["BENCH_DWH_PROD_DSN"])
+        prod_connector = CONNECTOR_DICT[prod_url.scheme](prod_url)
+    try:
+        create_main_branch(session=session)
+    except BranchError:
+        pass
+
+    prefix = f"bench_{int(time.time())}"
+    start = time.perf_counter()
+    history = generate(
+        session,
+        commits=args.commits,
+        tables=args.tables,
+        columns=args.columns,
+        branches=args.branches,
+        branch_commits=args.branch_commits,
+        prefix=prefix,
+        seed=args.seed,
+    )
+    generation_s = time.perf_counter() - start
+
+    counter = StatementCounter()
+    results = []
+    runs = args.runs
+    main_branch = get_branch(1, session=session)
+    branch = history.branches[0] if history.branches else create_branch(f"{prefix} branch", session=session)
+    table_id = history.tables[len(history.tables) // 2]
+    first_commit = session.query(Commit).filter(Commit.branch_id == main_branch.id).order_by(Commit.id).first()
+    wide, _, _ = create_table(
+        branch,
+        f"{prefix}_wide",
+        [(f"col_{number}", "INTEGER") for number in range(args.wide_columns)],
+        session=session,
+    )
+
+    results.append(measure("get_table", lambda: get_table(branch, table_id), counter, runs))
+    results.append(
+        measure(
+            "get_table_at_commit",
+            lambda: get_table(branch, table_id, start_from_commit=main_branch.head_commit),
+            counter,
+            runs,
+        )
+    )
+    results.append(measure("get_tables", lambda: get_tables(branch), counter, runs))
+    results.append(measure("get_schema", lambda: get_schema(branch), counter, runs))
+    results.append(measure("get_schema_at_first_commit", lambda: get_schema(branch, first_commit), counter, runs))
+    # Legacy walk with queries per commit, one run is enough to see it
+    results.append(measure("get_columns_wide", lambda: get_columns(branch, wide, session), counter, 1))
+    results.append(measure("check_conflicts", lambda: check_conflicts(branch, session=session), counter, runs))
+
+    merged = create_branch(f"{prefix} merged", session=session)
+    create_table(
+        merged, f"{prefix}_merged", [(f"col_{number}", "INTEGER") for number in range(args.columns)], session=session
+    )
+
+    def clear_migration():
+        for commit in merged.own_commits:
+            commit.sql_up = commit.sql_down = commit.sql_dialect = None
+        session.flush()
+
+    results.append(
+        measure("generate_migration", lambda: test_connector.generate_migration(merged), counter, runs, clear_migration)
+    )
+    test_connector.generate_migration(merged)
+    session.flush()
+    commits = merged.own_commits
+    results.append(measure("upgrade", lambda: test_connector.downgrade(test_connector.upgrade(commits)), counter, runs))
+    request_merge_branch(merged, session=session, test_connector=test_connector)
+    if prod_connector is not None:
+        results.append(
+            measure(
+                "ok_branch",
+                lambda: ok_branch(
+                    merged, session=session, test_connector=test_connector, prod_connector=prod_connector
+                ),
+                counter,
+                1,
+            )
+        )
+    else:
+        logger.info("ok_branch: skipped, BENCH_DWH_PROD_DSN is not set")
+
+    report = dict(
+        created_at=datetime.utcnow().isoformat(),
+        python=platform.python_version(),
+        parameters=vars(args),
+        generation_s=generation_s,
+        results=results,
+    )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
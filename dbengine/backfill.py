@@ -0,0 +1,99 @@
+"""Backfill data of branches created before it was maintained
+
+Runs on every start of service and does nothing if all branches are up to date.
+It can be run by hand too: python -m dbengine.backfill
+"""
+
+import logging
+
+from sqlalchemy import and_, create_engine, func, or_, select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from dbengine.methods.bulk import transaction
+from dbengine.methods.state import advance_head, rebuild_state
+from dbengine.models import Branch, BranchState, Commit, DbColumn, DbColumnAttributes, DbTableAttributes
+from dbengine.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_heads(*, session: Session) -> int:
+    """Point head of every branch without one to its last commit, returns number of fixed branches"""
+    branches = session.query(Branch).filter(Branch.head_commit_id.is_(None)).all()
+    fixed = 0
+    for branch in branches:
+        last = (
+            session.query(Commit)
+            .filter(Commit.branch_id == branch.id)
+            .order_by(Commit.create_ts.desc(), Commit.id.desc())
+            .first()
+        )
+        if last is None:
+            continue
+        advance_head(branch, last.id, None, session=session)
+        fixed += 1
+    if fixed:
+        logger.info("Heads of %d branches backfilled", fixed)
+    return fixed
+
+
+def backfill_states(*, session: Session) -> int:
+    """Replay history of every branch without state, returns number of rebuilt branches
+
+    Branches created after states were introduced always have some, if their history has any changes
+    """
+    has_state = session.query(BranchState.branch_id).filter(BranchState.branch_id == Branch.id).exists()
+    branches = session.query(Branch).filter(Branch.head_commit_id.isnot(None), ~has_state).all()
+    rebuilt = 0
+    for branch in branches:
+        rebuild_state(branch, session=session)
+        rebuilt += 1
+    if rebuilt:
+        logger.info("States of %d branches rebuilt", rebuilt)
+    return rebuilt
+
+
+def backfill_commit_tables(*, session: Session) -> int:
+    """Set table touched by commit to commits made before it was stored, returns number of fixed commits
+
+    Table is taken from attributes of commit, older column attributes have no table and it is taken
+    from the column. Merge conflicts are found by these tables.
+    """
+    attribute_id = func.coalesce(Commit.attribute_id_out, Commit.attribute_id_in)
+    table_of_table = select(DbTableAttributes.table_id).where(DbTableAttributes.id == attribute_id)
+    table_of_column = (
+        select(func.coalesce(DbColumnAttributes.table_id, DbColumn.table_id))
+        .join(DbColumn, DbColumn.id == DbColumnAttributes.column_id)
+        .where(DbColumnAttributes.id == attribute_id)
+    )
+    query = (
+        update(Commit)
+        .where(
+            and_(
+                Commit.table_id.is_(None),
+                or_(Commit.attribute_id_in.isnot(None), Commit.attribute_id_out.isnot(None)),
+            )
+        )
+        .values(table_id=func.coalesce(table_of_table.scalar_subquery(), table_of_column.scalar_subquery()))
+    )
+    fixed = session.execute(query.execution_options(synchronize_session=False)).rowcount
+    if fixed:
+        logger.info("Tables of %d commits backfilled", fixed)
+    return fixed
+
+
+def backfill(*, session: Session) -> None:
+    """Fill everything missing in branches created by older versions
+
+    Heads go first, state is replayed from them
+    """
+    with transaction(session):
+        backfill_heads(session=session)
+        backfill_states(session=session)
+        backfill_commit_tables(session=session)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    engine = create_engine(Settings().DB_DSN)
+    backfill(session=sessionmaker(engine, autocommit=True, autoflush=False)())
@@ -1,3 +1,3 @@
-from .db_connector import PostgreConnector, CONNECTOR_DICT
+from .db_connector import PostgreConnector, CONNECTOR_DICT, dispose_engines, get_engine
 
-__all__ = ["PostgreConnector", "CONNECTOR_DICT"]
+__all__ = ["PostgreConnector", "CONNECTOR_DICT", "dispose_engines", "get_engine"]
@@ -1,42 +1,108 @@
 import logging
+import threading
 from abc import ABCMeta, abstractmethod
-from typing import Final, Tuple, Optional, List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Callable, Final, Tuple, Optional, List, Dict, Sequence
 
 from pydantic import AnyUrl
-from sqlalchemy.engine import create_engine
+from sqlalchemy.engine import Connection, Engine, TwoPhaseTransaction, create_engine
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError
-from sqlalchemy.future import Connection
 
-from dbengine.exceptions import MigrationError
+from dbengine.exceptions import FatalMigrationError, MigrationError, TableError
+from dbengine.metrics import DDL_SECONDS, register_engine
 from dbengine.methods import get_table
 from dbengine.models.branch import Branch, CommitActionTypes, Commit
 from dbengine.models.entity import AttributeTypes
+from .planner import (
+    COLUMN_ACTIONS,
+    Statement,
+    Step,
+    StepActions,
+    commit_steps,
+    group_steps,
+    independent_groups,
+    plan_migration,
+)
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(connection_url: AnyUrl, **pool_args) -> Engine:
+    """
+    Get long-lived pooled engine for database url, engine is created on first request
+    """
+    with _engines_lock:
+        if str(connection_url) not in _engines:
+            _engines[str(connection_url)] = create_engine(connection_url, **pool_args)
+        return _engines[str(connection_url)]
+
+
+def dispose_engines() -> None:
+    """
+    Close all pooled connections of coordinated databases
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
 
 
 class IDbConnector(metaclass=ABCMeta):
     """
     Fields:
-    __coordinated_connection: Connection
-        Connection to the coordinated database
     __coordinated_connection_url: AnyURL
         URL coordinated database
+    __pool_args: dict
+        Connection pool settings of coordinated database engine
+    transactional: bool
+        Whether migrations run in one transaction, possible only if database supports transactional DDL
+    target: str
+        Name of coordinated database in metrics
+    compact: bool
+        Whether commits are folded into minimal DDL before migration, see `plan`
+    parallelism: int
+        Number of connections migrating independent tables concurrently
     """
 
-    __coordinated_connection: Connection = None
     __coordinated_connection_url: AnyUrl = None
+    __pool_args: dict = None
+    dialect: str = None
+    transactional_ddl: bool = False
 
-    def connect(self):
+    def connect(self) -> Optional[Engine]:
         """
-        Connect to coordinated database
+        Get pooled engine of coordinated database
         """
         try:
-            engine = create_engine(self.__coordinated_connection_url, pool_pre_ping=True)
-            self.__coordinated_connection = engine.connect()
+            engine = get_engine(self.__coordinated_connection_url, **self.__pool_args)
+            register_engine(engine, self.target)
+            return engine
         except SQLAlchemyError:
             logging.error(SQLAlchemyError, exc_info=True)
 
-    def __init__(self, connection_url: AnyUrl):
+    def __init__(
+        self,
+        connection_url: AnyUrl,
+        *,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_recycle: int = 1800,
+        pool_pre_ping: bool = True,
+        transactional: bool = True,
+        target: str = "dwh",
+        compact: bool = True,
+        parallelism: int = 1,
+    ):
         self.__coordinated_connection_url = connection_url
+        self.target = target
+        self.compact = compact
+        self.parallelism = parallelism
+        self.transactional = transactional and self.transactional_ddl
+        self.__pool_args = dict(
+            pool_size=pool_size, max_overflow=max_overflow, pool_recycle=pool_recycle, pool_pre_ping=pool_pre_ping
+        )
 
     @staticmethod
     def __get_action_of_commit(commit: Commit) -> str:
@@ -66,22 +132,45 @@ class IDbConnector(metaclass=ABCMeta):
         return name1, name2
 
     @staticmethod
-    def __get_names_column_in_commit(commit: Commit) -> Tuple:
+    def __get_names_column_in_commit(
+        commit: Commit, tablenames: Dict[int, str], branch: Branch, start_from_commit: Optional[Commit] = None
+    ) -> Tuple:
         """
-        Get old and new columnname in commit
+        Get tablename, old and new columnname in commit
+
+        `tablenames` maps table id to its name at the moment of commit, tables missing in it
+        weren't renamed in branch and are resolved from branch state
         """
         attr_in, attr_out = commit.attribute_in, commit.attribute_out
         tablename, name1, name2, datatype1, datatype2 = None, None, None, None, None
         if IDbConnector.__get_type_of_commit_object(commit) == AttributeTypes.COLUMN:
             if attr_in is not None:
                 name1, datatype1 = attr_in.name, attr_in.datatype
-                tablename = get_table(commit.branch, attr_in.column.table_id, commit)[1].name
             if attr_out is not None:
                 name2, datatype2 = attr_out.name, attr_out.datatype
-                if not tablename:
-                    tablename = get_table(commit.branch, attr_out.column.table_id, commit)[1].name
+            anyattr = attr_in or attr_out
+            table_id = anyattr.table_id or anyattr.column.table_id
+            if table_id not in tablenames:
+                try:
+                    tablenames[table_id] = get_table(branch, table_id, start_from_commit)[1].name
+                except TableError:
+                    tablenames[table_id] = None
+            tablename = tablenames[table_id]
         return tablename, name1, datatype1, name2, datatype2
 
+    @staticmethod
+    def __get_tablenames_at_branch_point(commits: List[Commit]) -> Dict[int, str]:
+        """
+        Get names of tables at the moment of branching, `commits` are branch commits oldest first
+
+        Only tables altered in branch are listed, their names are taken from the first altering commit
+        """
+        tablenames = {}
+        for row in commits:
+            if IDbConnector.__get_type_of_commit_object(row) == AttributeTypes.TABLE and row.attribute_in is not None:
+                tablenames.setdefault(row.attribute_in.table_id, row.attribute_in.name)
+        return tablenames
+
     @staticmethod
     def __get_type_of_commit_object(commit: Commit) -> Optional[str]:
         """
@@ -94,9 +183,9 @@ class IDbConnector(metaclass=ABCMeta):
 
     @staticmethod
     @abstractmethod
-    def _create_table(tablename: str) -> str:
+    def _create_table(tablename: str, columns: Sequence[Tuple[str, str]] = ()) -> str:
         """
-        Generate query code to create table
+        Generate query code to create table, `columns` are pairs of name and type
         """
         raise NotImplementedError
 
@@ -140,29 +229,99 @@ class IDbConnector(metaclass=ABCMeta):
         """
         raise NotImplementedError
 
-    def generate_migration(self, branch: Branch):
+    @staticmethod
+    @abstractmethod
+    def _rename_column(tablename: str, columnname: str, new_name: str) -> str:
         """
-        Generates SQL Code for migration any DataBase
+        Generate query code to rename column
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    @abstractmethod
+    def _add_column_action(columnname: str, columntype: str) -> str:
+        """
+        Generate action of ALTER TABLE adding column
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    @abstractmethod
+    def _drop_column_action(columnname: str) -> str:
+        """
+        Generate action of ALTER TABLE deleting column
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    @abstractmethod
+    def _alter_column_type_action(columnname: str, new_datatype: str) -> str:
+        """
+        Generate action of ALTER TABLE changing type of column
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    @abstractmethod
+    def _alter_table_actions(tablename: str, actions: Sequence[str]) -> str:
         """
-        s = branch.commits
-        for row in s:
+        Generate query code applying several actions to table in one statement
+        """
+        raise NotImplementedError
+
+    def _render_action(self, step: Step) -> str:
+        """
+        Generate ALTER TABLE action of column step
+        """
+        if step.action == StepActions.ADD_COLUMN:
+            return self._add_column_action(step.column, step.datatype)
+        if step.action == StepActions.DROP_COLUMN:
+            return self._drop_column_action(step.column)
+        return self._alter_column_type_action(step.column, step.new_datatype)
+
+    def _render(self, steps: List[Step]) -> str:
+        """
+        Generate query code of group of migration plan steps, see `group_steps`
+        """
+        step = steps[0]
+        if step.action in COLUMN_ACTIONS:
+            return self._alter_table_actions(step.table, [self._render_action(row) for row in steps])
+        if step.action == StepActions.CREATE_TABLE:
+            return self._create_table(step.table, step.columns)
+        if step.action == StepActions.DROP_TABLE:
+            return self._delete_table(step.table)
+        if step.action == StepActions.RENAME_TABLE:
+            return self._alter_table(step.table, step.new_name)
+        return self._rename_column(step.table, step.column, step.new_name)
+
+    def generate_sql(
+        self, commits: List[Commit], branch: Branch, start_from_commit: Optional[Commit] = None
+    ) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Generate SQL code of consecutive commits, oldest first, without changing them
+
+        Returns pair of up and down migration of every commit, None if commit can't be migrated.
+        Tables not renamed by commits are named as in branch at `start_from_commit`.
+        """
+        tablenames = IDbConnector.__get_tablenames_at_branch_point(commits)
+        result = []
+        for row in commits:
             object_type = IDbConnector.__get_type_of_commit_object(row)
             action_type = IDbConnector.__get_action_of_commit(row)
+            sql_up, sql_down = None, None
             if object_type == AttributeTypes.TABLE:
                 name1, name2 = IDbConnector.__get_names_table_in_commit(row)
-            elif object_type == AttributeTypes.COLUMN:
-                tablename, name1, datatype1, name2, datatype2 = IDbConnector.__get_names_column_in_commit(row)
-            if object_type == AttributeTypes.TABLE:
+                tablenames[(row.attribute_in or row.attribute_out).table_id] = name2 or name1
                 if action_type == CommitActionTypes.CREATE and name1 is None and name2 is not None:
-                    row.sql_up = self._create_table(name2)
-                    row.sql_down = self._delete_table(name2)
+                    sql_up, sql_down = self._create_table(name2), self._delete_table(name2)
                 elif action_type == CommitActionTypes.ALTER and name1 is not None and name2 is not None:
-                    row.sql_up = self._alter_table(name1, name2)
-                    row.sql_down = self._alter_table(name2, name1)
+                    sql_up, sql_down = self._alter_table(name1, name2), self._alter_table(name2, name1)
                 elif action_type == CommitActionTypes.DROP and name1 is not None and name2 is None:
-                    row.sql_up = self._delete_table(name1)
-                    row.sql_down = self._create_table(name1)
+                    sql_up, sql_down = self._delete_table(name1), self._create_table(name1)
             elif object_type == AttributeTypes.COLUMN:
+                tablename, name1, datatype1, name2, datatype2 = IDbConnector.__get_names_column_in_commit(
+                    row, tablenames, branch, start_from_commit
+                )
                 if (
                     action_type == CommitActionTypes.CREATE
                     and name1 is None
@@ -171,8 +330,8 @@ class IDbConnector(metaclass=ABCMeta):
                     and datatype2 is not None
                     and tablename is not None
                 ):
-                    row.sql_up = self._create_column(tablename, name2, datatype2)
-                    row.sql_down = self._delete_column(tablename, name2)
+                    sql_up = self._create_column(tablename, name2, datatype2)
+                    sql_down = self._delete_column(tablename, name2)
                 elif (
                     action_type == CommitActionTypes.ALTER
                     and name1 is not None
@@ -181,8 +340,8 @@ class IDbConnector(metaclass=ABCMeta):
                     and datatype2 is not None
                     and tablename is not None
                 ):
-                    row.sql_up = self._alter_column(tablename, name1, name2, datatype1, datatype2)
-                    row.sql_down = self._alter_column(tablename, name2, name1, datatype2, datatype1)
+                    sql_up = self._alter_column(tablename, name1, name2, datatype1, datatype2)
+                    sql_down = self._alter_column(tablename, name2, name1, datatype2, datatype1)
                 elif (
                     action_type == CommitActionTypes.DROP
                     and name1 is not None
@@ -191,50 +350,234 @@ class IDbConnector(metaclass=ABCMeta):
                     and datatype2 is None
                     and tablename is not None
                 ):
-                    row.sql_up = self._delete_column(tablename, name1)
-                    row.sql_down = self._create_column(tablename, name1, datatype1)
+                    sql_up = self._delete_column(tablename, name1)
+                    sql_down = self._create_column(tablename, name1, datatype1)
+            result.append((sql_up, sql_down))
+        return result
+
+    def generate_migration(self, branch: Branch):
+        """
+        Generates SQL Code for migration any DataBase
+
+        Only commits made in branch are swept, from the oldest one. Commits which already have SQL
+        generated by this dialect keep it, their inputs are immutable.
+        Stored SQL of every commit is informational, for history and audit. Statements which actually
+        run are built by `plan` from attributes of commits and may differ from it.
+        """
+        s = list(reversed(branch.own_commits))
+        for row, (sql_up, sql_down) in zip(s, self.generate_sql(s, branch)):
+            if row.sql_up is not None and row.sql_dialect == self.dialect:
+                continue
+            row.sql_dialect, row.sql_up, row.sql_down = self.dialect, sql_up, sql_down
+
+    def plan(self, commits: List[Commit]) -> List[Statement]:
+        """
+        Get statements migrating commits made in branch and statements undoing them, in order of execution
+
+        `commits` are expected newest first. Commits are folded into minimal DDL per object, unless
+        compaction is turned off or commits can't be compacted, then every commit is migrated by itself.
+        Either way consecutive column actions on one table are combined into one statement.
+        SQL stored on commits by `generate_migration` is not executed, it only marks commits as generated
+        for this dialect, which is required to compact them.
+        """
+        s = [row for row in reversed(commits) if row.attribute_id_in is not None or row.attribute_id_out is not None]
+        steps = None
+        if self.compact and all(row.sql_up is not None and row.sql_dialect == self.dialect for row in s):
+            steps = plan_migration(s)
+        if steps is None:
+            steps = commit_steps(s)
+        return [
+            Statement(
+                self._render(group),
+                self._render([step.inverse() for step in reversed(group)]),
+                group[0].table_id,
+                frozenset().union(*(step.table_names for step in group)),
+            )
+            for group in group_steps(steps)
+        ]
+
+    def _split(self, statements: List[Statement]) -> List[List[Statement]]:
+        """
+        Split statements between at most `parallelism` connections
+
+        Independent groups of tables are given to the least loaded connection, order of statements
+        of every group is kept.
+        """
+        if self.parallelism <= 1 or not statements:
+            return [statements] if statements else []
+        groups = independent_groups(statements)
+        parts = [[] for _ in range(min(self.parallelism, len(groups)))]
+        for group in groups:
+            min(parts, key=len).extend(group)
+        return parts
+
+    def _run_concurrently(self, func: Callable, items: List) -> List:
+        """
+        Call `func` for every item in its own thread, results are in order of items
+        """
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(len(items), thread_name_prefix=f"migration-{self.target}") as executor:
+            return list(executor.map(func, items))
 
     def upgrade(self, commits: List[Commit]) -> Optional[List[str]]:
-        rollback, commits_up, commits_down = [], [], []
-        for row in commits:
-            if row.sql_up is not None and row.sql_down is not None:
-                for line in reversed(row.sql_up.splitlines()):
-                    commits_up.append(line)
-                for line in row.sql_down.splitlines():
-                    commits_down.append(line)
-            if row.prev_commit.branch_id == 1:
-                break
-        i = 0
-        commits_down.reverse()
-        for row in commits_up.__reversed__():
+        """
+        Apply migration of commits made in branch, `commits` are expected newest first
+
+        Independent tables are migrated concurrently over `parallelism` connections. If any statement fails,
+        applied statements of all tables are undone and MigrationError is raised.
+        Returns statements undoing migration.
+        """
+        engine = self.connect()
+
+        def run(statements: List[Statement]) -> Tuple[List[str], Optional[MigrationError]]:
+            rollback = []
+            with engine.connect() as connection:
+                for statement in statements:
+                    try:
+                        with DDL_SECONDS.labels(self.target).time():
+                            connection.exec_driver_sql(statement.up)
+                    except DBAPIError as e:
+                        return rollback, MigrationError(f"Migration failed on {statement.up!r}: {e.orig}")
+                    rollback.append(statement.down)
+            return rollback, None
+
+        results = self._run_concurrently(run, self._split(self.plan(commits)))
+        errors = [error for _, error in results if error is not None]
+        if errors:
             try:
-                self.__coordinated_connection.execute(row)
-                rollback.append(commits_down[i])
-                i += 1
-            except DBAPIError:
-                raise MigrationError
-        return rollback
+                self._run_concurrently(self.downgrade, [rollback for rollback, _ in results])
+            except MigrationError:
+                raise FatalMigrationError
+            raise errors[0]
+        return [row for rollback, _ in results for row in rollback]
 
-    def downgrade(self, rollback: List[str]) -> None:
-        for row in rollback.__reversed__():
+    def _supports_two_phase(self, connection: Connection) -> bool:
+        """
+        Check if coordinated database can prepare transactions for two-phase commit
+        """
+        return False
+
+    def check_parallelism(self) -> None:
+        """
+        Check once on start of service that parallel migration can run, see `migrate`
+
+        Concurrent transactional migration needs two-phase commit, without it `parallelism` is dropped to 1
+        """
+        if self.parallelism <= 1 or not self.transactional:
+            return
+        try:
+            with self.connect().connect() as connection:
+                supported = self._supports_two_phase(connection)
+        except SQLAlchemyError:
+            logging.error("Failed to check two-phase commit on %s", self.target, exc_info=True)
+            return
+        if not supported:
+            logging.error(
+                "Two-phase commit is not available on %s, migrations run serially despite parallelism %d. "
+                "Enable prepared transactions in database to migrate in parallel",
+                self.target,
+                self.parallelism,
+            )
+            self.parallelism = 1
+
+    def _rollback_prepared(self, transactions: List[TwoPhaseTransaction]) -> None:
+        """
+        Roll back prepared transactions left after failed two-phase commit
+
+        Transactions which can't be rolled back are logged by xid to be finished by hand.
+        """
+        for transaction in transactions:
             try:
-                self.__coordinated_connection.execute(row)
-            except DBAPIError:
-                raise MigrationError
+                with self.connect().connect() as connection:
+                    connection.rollback_prepared(transaction.xid, recover=True)
+            except SQLAlchemyError:
+                logging.error(
+                    "Prepared migration %r on %s is not rolled back, check pg_prepared_xacts",
+                    transaction.xid,
+                    self.target,
+                    exc_info=True,
+                )
+
+    def migrate(self, commits: List[Commit], *, commit: bool = True) -> None:
+        """
+        Apply migration of commits made in branch in transactions, `commits` are expected newest first
+
+        Independent tables are migrated concurrently over `parallelism` connections, each in its own
+        transaction, and every statement runs in its own savepoint. Transactions are committed with
+        two-phase commit only if all of them succeed, otherwise all are rolled back by database.
+        Database has to support prepared transactions, see `check_parallelism`.
+        With `commit=False` migration is only validated and rolled back in the end.
+        """
+        engine = self.connect()
+        parts = self._split(self.plan(commits))
+        with ExitStack() as stack:
+            connections = [stack.enter_context(engine.connect()) for _ in parts]
+            two_phase = len(parts) > 1
+            transactions = [
+                connection.begin_twophase() if two_phase else connection.begin() for connection in connections
+            ]
+
+            def run(part: Tuple[Connection, List[Statement]]) -> Optional[MigrationError]:
+                connection, statements = part
+                for statement in statements:
+                    try:
+                        with connection.begin_nested():
+                            with DDL_SECONDS.labels(self.target).time():
+                                connection.exec_driver_sql(statement.up)
+                    except DBAPIError as e:
+                        return MigrationError(f"Migration failed on {statement.up!r}: {e.orig}")
+                return None
+
+            errors = [error for error in self._run_concurrently(run, list(zip(connections, parts))) if error]
+            if not errors and commit and two_phase:
+                try:
+                    for transaction in transactions:
+                        transaction.prepare()
+                except DBAPIError as e:
+                    errors.append(MigrationError(f"Failed to prepare migration: {e.orig}"))
+            if errors or not commit:
+                for transaction in transactions:
+                    transaction.rollback()
+                if errors:
+                    raise errors[0]
+                return
+            for index, transaction in enumerate(transactions):
+                try:
+                    transaction.commit()
+                except SQLAlchemyError:
+                    # Committed parts can't be undone, the rest is kept by database until rolled back
+                    logging.error("Failed to commit prepared migration on %s", self.target, exc_info=True)
+                    self._rollback_prepared(transactions[index:] if two_phase else [])
+                    raise FatalMigrationError
+
+    def downgrade(self, rollback: List[str]) -> None:
+        with self.connect().connect() as connection:
+            for row in rollback.__reversed__():
+                try:
+                    with DDL_SECONDS.labels(self.target).time():
+                        connection.exec_driver_sql(row)
+                except DBAPIError:
+                    raise MigrationError
 
 
 class PostgreConnector(IDbConnector):
+    dialect = "postgresql"
+    transactional_ddl = True
+
     @staticmethod
-    def _create_table(tablename: str):
-        return f"CREATE TABLE {tablename} ();"
+    def _create_table(tablename: str, columns: Sequence[Tuple[str, str]] = ()):
+        return f"CREATE TABLE {tablename} ({', '.join(f'{name} {datatype}' for name, datatype in columns)});"
 
     @staticmethod
     def _create_column(tablename: str, columnname: str, columntype: str):
-        return f'ALTER TABLE {tablename} ADD COLUMN {columnname} {columntype};'
+        return PostgreConnector._alter_table_actions(
+            tablename, [PostgreConnector._add_column_action(columnname, columntype)]
+        )
 
     @staticmethod
     def _delete_column(tablename: str, columnname: str):
-        return f"ALTER TABLE {tablename} DROP COLUMN {columnname};"
+        return PostgreConnector._alter_table_actions(tablename, [PostgreConnector._drop_column_action(columnname)])
 
     @staticmethod
     def _delete_table(tablename: str):
@@ -253,5 +596,28 @@ class PostgreConnector(IDbConnector):
         )
         return f"{first_query}{second_query}"
 
+    @staticmethod
+    def _rename_column(tablename: str, columnname: str, new_name: str):
+        return f"ALTER TABLE {tablename} RENAME COLUMN {columnname} TO {new_name};"
+
+    @staticmethod
+    def _add_column_action(columnname: str, columntype: str):
+        return f"ADD COLUMN {columnname} {columntype}"
+
+    @staticmethod
+    def _drop_column_action(columnname: str):
+        return f"DROP COLUMN {columnname}"
+
+    @staticmethod
+    def _alter_column_type_action(columnname: str, new_datatype: str):
+        return f"ALTER COLUMN {columnname} TYPE {new_datatype} USING {columnname}::{new_datatype}"
+
+    @staticmethod
+    def _alter_table_actions(tablename: str, actions: Sequence[str]):
+        return f"ALTER TABLE {tablename} {', '.join(actions)};"
+
+    def _supports_two_phase(self, connection: Connection) -> bool:
+        return int(connection.exec_driver_sql("SHOW max_prepared_transactions").scalar()) > 0
+
 
 CONNECTOR_DICT: Final[Dict[str, IDbConnector]] = {"postgresql": PostgreConnector}
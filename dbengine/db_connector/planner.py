@@ -0,0 +1,289 @@
+import logging
+from enum import Enum
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from dbengine.exceptions import TableError
+from dbengine.methods import get_table
+from dbengine.models.branch import Commit
+from dbengine.models.entity import AttributeTypes, DbAttributes
+
+logger = logging.getLogger(__name__)
+
+
+class StepActions(str, Enum):
+    CREATE_TABLE = "CREATE TABLE"
+    DROP_TABLE = "DROP TABLE"
+    RENAME_TABLE = "RENAME TABLE"
+    ADD_COLUMN = "ADD COLUMN"
+    DROP_COLUMN = "DROP COLUMN"
+    RENAME_COLUMN = "RENAME COLUMN"
+    ALTER_COLUMN_TYPE = "ALTER COLUMN TYPE"
+
+
+COLUMN_ACTIONS = (StepActions.ADD_COLUMN, StepActions.DROP_COLUMN, StepActions.ALTER_COLUMN_TYPE)
+
+
+class Step(NamedTuple):
+    """One DDL statement of migration plan, independent of dialect
+
+    `table` is name of table at the moment of statement. Column statements use `column` and `datatype`,
+    renames put new name to `new_name`, type changes put new type to `new_datatype`.
+    Tables are created with `columns`, pairs of column name and type, dropped tables keep their columns
+    in it to be recreated by inverse step.
+    """
+
+    action: StepActions
+    table_id: int
+    table: str
+    column: Optional[str] = None
+    datatype: Optional[str] = None
+    new_name: Optional[str] = None
+    new_datatype: Optional[str] = None
+    columns: Tuple[Tuple[str, str], ...] = ()
+
+    @property
+    def table_names(self) -> FrozenSet[str]:
+        """Names of tables used by step"""
+        if self.action == StepActions.RENAME_TABLE:
+            return frozenset((self.table, self.new_name))
+        return frozenset((self.table,))
+
+    def inverse(self) -> "Step":
+        """Step undoing this one"""
+        if self.action == StepActions.CREATE_TABLE:
+            return self._replace(action=StepActions.DROP_TABLE)
+        if self.action == StepActions.DROP_TABLE:
+            return self._replace(action=StepActions.CREATE_TABLE)
+        if self.action == StepActions.RENAME_TABLE:
+            return self._replace(table=self.new_name, new_name=self.table)
+        if self.action == StepActions.ADD_COLUMN:
+            return self._replace(action=StepActions.DROP_COLUMN)
+        if self.action == StepActions.DROP_COLUMN:
+            return self._replace(action=StepActions.ADD_COLUMN)
+        if self.action == StepActions.RENAME_COLUMN:
+            return self._replace(column=self.new_name, new_name=self.column)
+        return self._replace(datatype=self.new_datatype, new_datatype=self.datatype)
+
+
+class Statement(NamedTuple):
+    """Statement of migration, statement undoing it and tables it touches
+
+    `table_id` is None if table is unknown, `names` are names of tables used by statement.
+    """
+
+    up: str
+    down: str
+    table_id: Optional[int] = None
+    names: FrozenSet[str] = frozenset()
+
+
+def _collides(before: Dict[int, Optional[DbAttributes]], after: Dict[int, Optional[DbAttributes]]) -> bool:
+    """Check if name freed by one entity is taken by another one
+
+    Compacted statements don't follow order of commits, so such names could clash in database.
+    """
+    freed, taken = {}, {}
+    for entity_id in before:
+        old, new = before[entity_id], after[entity_id]
+        if old is not None and (new is None or new.name != old.name):
+            freed[old.name] = entity_id
+        if new is not None and (old is None or new.name != old.name):
+            taken[new.name] = entity_id
+    return any(name in freed and freed[name] != entity_id for name, entity_id in taken.items())
+
+
+def plan_migration(commits: List[Commit]) -> Optional[List[Step]]:
+    """Fold commits of branch, oldest first, into minimal equivalent DDL
+
+    Every object gets statements from its state before the first commit to its state after the last one:
+    created and dropped objects are skipped, renames and type changes collapse to one statement,
+    columns of new table are created with it. Returns None if commits can't be compacted safely,
+    then they should be migrated one by one.
+    """
+    before: Dict[int, Optional[DbAttributes]] = {}
+    after: Dict[int, Optional[DbAttributes]] = {}
+    columns: Dict[int, List[int]] = {}
+    branch = None
+    for commit in commits:
+        attr = commit.attribute_in or commit.attribute_out
+        if attr is None:
+            continue
+        branch = commit.branch
+        table_id = attr.table_id if attr.type == AttributeTypes.TABLE else attr.table_id or attr.column.table_id
+        table_columns = columns.setdefault(table_id, [])
+        if attr.type == AttributeTypes.COLUMN and attr.entity_id not in before:
+            table_columns.append(attr.entity_id)
+        before.setdefault(attr.entity_id, commit.attribute_in)
+        after[attr.entity_id] = commit.attribute_out
+
+    tables = {table_id: before[table_id] for table_id in columns if table_id in before}
+    if _collides(tables, {table_id: after[table_id] for table_id in tables}):
+        logger.debug("Table names collide, migration is not compacted")
+        return None
+
+    steps = []
+    for table_id, column_ids in columns.items():
+        column_before = {column_id: before[column_id] for column_id in column_ids}
+        column_after = {column_id: after[column_id] for column_id in column_ids}
+        if table_id in before:
+            old, new = before[table_id], after[table_id]
+        else:
+            try:
+                old = new = get_table(branch, table_id)[1]
+            except TableError:
+                logger.debug(f"Table {table_id} not found, migration is not compacted")
+                return None
+        if old is None and new is None:
+            continue
+        if old is None:
+            created = tuple((attr.name, attr.datatype) for attr in column_after.values() if attr is not None)
+            steps.append(Step(StepActions.CREATE_TABLE, table_id, new.name, columns=created))
+            continue
+        if new is None:
+            # Columns are dropped with table, they are kept to recreate it on rollback
+            dropped = tuple(
+                (attr.name, attr.datatype)
+                for _, attr in sorted(column_before.items(), key=lambda item: item[0])
+                if attr is not None
+            )
+            steps.append(Step(StepActions.DROP_TABLE, table_id, old.name, columns=dropped))
+            continue
+        if _collides(column_before, column_after):
+            logger.debug(f"Column names of table {table_id} collide, migration is not compacted")
+            return None
+        if old.name != new.name:
+            steps.append(Step(StepActions.RENAME_TABLE, table_id, old.name, new_name=new.name))
+        # Renames go first, so the rest of column actions follow each other and run as one statement
+        renames, actions = [], []
+        for column_id in column_ids:
+            column_old, column_new = column_before[column_id], column_after[column_id]
+            if column_old is None and column_new is None:
+                continue
+            if column_old is None:
+                actions.append(Step(StepActions.ADD_COLUMN, table_id, new.name, column_new.name, column_new.datatype))
+            elif column_new is None:
+                actions.append(Step(StepActions.DROP_COLUMN, table_id, new.name, column_old.name, column_old.datatype))
+            else:
+                if column_old.name != column_new.name:
+                    renames.append(
+                        Step(StepActions.RENAME_COLUMN, table_id, new.name, column_old.name, new_name=column_new.name)
+                    )
+                if column_old.datatype != column_new.datatype:
+                    actions.append(
+                        Step(
+                            StepActions.ALTER_COLUMN_TYPE,
+                            table_id,
+                            new.name,
+                            column_new.name,
+                            column_old.datatype,
+                            new_datatype=column_new.datatype,
+                        )
+                    )
+        steps.extend(renames + actions)
+    return steps
+
+
+def commit_steps(commits: List[Commit]) -> List[Step]:
+    """Translate every commit of branch, oldest first, into its own steps without compaction
+
+    Tables not renamed by commits are named as in branch. Commits which can't be migrated,
+    e.g. changes of columns in unknown table, are skipped.
+    """
+    tablenames: Dict[int, Optional[str]] = {}
+    for commit in commits:
+        attr = commit.attribute_in
+        if attr is not None and attr.type == AttributeTypes.TABLE:
+            tablenames.setdefault(attr.table_id, attr.name)
+    steps = []
+    for commit in commits:
+        old, new = commit.attribute_in, commit.attribute_out
+        attr = old or new
+        if attr is None:
+            continue
+        if attr.type == AttributeTypes.TABLE:
+            tablenames[attr.table_id] = new.name if new is not None else old.name
+            if old is None:
+                steps.append(Step(StepActions.CREATE_TABLE, attr.table_id, new.name))
+            elif new is None:
+                steps.append(Step(StepActions.DROP_TABLE, attr.table_id, old.name))
+            elif old.name != new.name:
+                steps.append(Step(StepActions.RENAME_TABLE, attr.table_id, old.name, new_name=new.name))
+            continue
+        table_id = attr.table_id or attr.column.table_id
+        if table_id not in tablenames:
+            try:
+                tablenames[table_id] = get_table(commit.branch, table_id)[1].name
+            except TableError:
+                tablenames[table_id] = None
+        table = tablenames[table_id]
+        if table is None:
+            continue
+        if old is None:
+            steps.append(Step(StepActions.ADD_COLUMN, table_id, table, new.name, new.datatype))
+        elif new is None:
+            steps.append(Step(StepActions.DROP_COLUMN, table_id, table, old.name, old.datatype))
+        else:
+            if old.name != new.name:
+                steps.append(Step(StepActions.RENAME_COLUMN, table_id, table, old.name, new_name=new.name))
+            if old.datatype != new.datatype:
+                steps.append(
+                    Step(
+                        StepActions.ALTER_COLUMN_TYPE,
+                        table_id,
+                        table,
+                        new.name,
+                        old.datatype,
+                        new_datatype=new.datatype,
+                    )
+                )
+    return steps
+
+
+def group_steps(steps: List[Step]) -> List[List[Step]]:
+    """Group consecutive column actions on the same table, so table is locked and rewritten once
+
+    Renames can't be combined with other actions and stay alone. Database runs actions of one statement
+    in its own order, so column touched twice starts a new group.
+    """
+    groups, columns = [], set()
+    for step in steps:
+        previous = groups[-1][-1] if groups else None
+        if (
+            previous is not None
+            and step.action in COLUMN_ACTIONS
+            and previous.action in COLUMN_ACTIONS
+            and previous.table_id == step.table_id
+            and step.column not in columns
+        ):
+            groups[-1].append(step)
+        else:
+            groups.append([step])
+            columns = set()
+        columns.add(step.column)
+    return groups
+
+
+def independent_groups(statements: List[Statement]) -> List[List[Statement]]:
+    """Split statements into groups which can run concurrently, keeping order of statements in every group
+
+    Statements of one table or of tables sharing a name, e.g. dropped table and new one with its name,
+    fall into the same group. Statements of unknown tables depend on everything.
+    """
+    if any(statement.table_id is None for statement in statements):
+        return [statements] if statements else []
+    parent: Dict[Tuple[str, object], Tuple[str, object]] = {}
+
+    def find(key):
+        parent.setdefault(key, key)
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for statement in statements:
+        for name in statement.names:
+            parent[find(("name", name))] = find(("id", statement.table_id))
+    groups: Dict[Tuple[str, object], List[Statement]] = {}
+    for statement in statements:
+        groups.setdefault(find(("id", statement.table_id)), []).append(statement)
+    return list(groups.values())
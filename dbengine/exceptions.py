@@ -27,6 +27,18 @@ class BranchConflict(BranchError):
         super().__init__(message)
 
 
+class BranchHeadMoved(BranchError):
+    def __init__(self, branch_id: int):
+        message = f"Branch {branch_id} was changed concurrently, repeat the action"
+        super().__init__(message)
+
+
+class CommitNotFoundError(BranchError):
+    def __init__(self, commit: str, branch_name: str):
+        message = f"Commit {commit} not found in {branch_name} branch"
+        super().__init__(message)
+
+
 class MergeError(BranchError):
     def __init__(self, branch_id: int):
         message = f"Merging error occurred with branch {branch_id}"
@@ -63,6 +75,11 @@ class ColumnDeleted(ColumnError):
         super().__init__(message=f"Column {column_id} was deleted in {branch_name} branch")
 
 
+class BatchOperationError(Exception):
+    def __init__(self, index: int, message: str):
+        super().__init__(f"Operation {index} is invalid: {message}")
+
+
 class NotSupportedSchemeError(Exception):
     def __init__(self, message="This scheme in not supported"):
         super().__init__(message)
@@ -76,3 +93,18 @@ class MigrationError(BranchError):
 class FatalMigrationError(MigrationError):
     def __init__(self, message="Failed to create tables and failed to rollback version back"):
         super().__init__(message)
+
+
+class MergeJobError(Exception):
+    def __init__(self, message="Merge job error occurred"):
+        super().__init__(message)
+
+
+class MergeJobNotFoundError(MergeJobError):
+    def __init__(self, job_id: int):
+        super().__init__(message=f"Merge job with id {job_id} not found")
+
+
+class MergeJobAlreadyQueued(MergeJobError):
+    def __init__(self, branch_id: int):
+        super().__init__(message=f"Branch {branch_id} already has unfinished merge job")
@@ -0,0 +1,57 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Callable, Dict, Hashable, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner:
+    """
+    In-process pool of workers running long jobs out of HTTP requests
+
+    Fields:
+    __executor: ThreadPoolExecutor
+        Workers running jobs
+    __target_limits: Dict[Hashable, BoundedSemaphore]
+        Limits of jobs running concurrently against the same target, e.g. warehouse
+    """
+
+    def __init__(self, max_workers: int, target_concurrency: int):
+        self.__executor = ThreadPoolExecutor(max_workers, thread_name_prefix="job")
+        self.__target_concurrency = target_concurrency
+        self.__target_limits: Dict[Hashable, threading.BoundedSemaphore] = {}
+        self.__lock = threading.Lock()
+
+    def __get_limit(self, target: Hashable) -> threading.BoundedSemaphore:
+        with self.__lock:
+            if target not in self.__target_limits:
+                self.__target_limits[target] = threading.BoundedSemaphore(self.__target_concurrency)
+            return self.__target_limits[target]
+
+    def __run(self, job: Callable, targets: Iterable[Hashable], *args, **kwargs):
+        with ExitStack() as stack:
+            # Targets are always locked in the same order, so jobs can't deadlock each other
+            for target in sorted(targets, key=id):
+                stack.enter_context(self.__get_limit(target))
+            return job(*args, **kwargs)
+
+    def submit(self, job: Callable, *args, targets: Iterable[Hashable] = (), **kwargs) -> Future:
+        """
+        Run job in background once all its targets have free slots
+        """
+        future = self.__executor.submit(self.__run, job, list(targets), *args, **kwargs)
+        future.add_done_callback(self.__log_error)
+        return future
+
+    @staticmethod
+    def __log_error(future: Future) -> None:
+        if future.exception() is not None:
+            logger.error("Job failed", exc_info=future.exception())
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop accepting jobs and wait for running ones
+        """
+        self.__executor.shutdown(wait=wait)
@@ -9,21 +9,36 @@ from .branch import (
 
 from .table import create_table, get_table, get_tables, update_table, delete_table
 from .column import create_column, get_column, update_column, delete_column
+from .batch import apply_batch
+from .merge_job import create_merge_job, fail_unfinished_merge_jobs, get_merge_job, get_merge_jobs, run_merge_job
+from .schema import get_commit, get_commit_at, get_schema
+from .state import get_state, rebuild_state
 
 
 __all__ = [
+    "apply_batch",
     "create_branch",
     "create_column",
     "create_main_branch",
+    "create_merge_job",
     "create_table",
     "delete_column",
     "delete_table",
+    "fail_unfinished_merge_jobs",
     "get_branch",
     "get_column",
+    "get_commit",
+    "get_commit_at",
+    "get_merge_job",
+    "get_merge_jobs",
+    "get_schema",
+    "get_state",
     "get_table",
     "get_tables",
     "ok_branch",
+    "rebuild_state",
     "request_merge_branch",
+    "run_merge_job",
     "unrequest_merge_branch",
     "update_column",
     "update_table",
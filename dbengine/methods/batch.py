@@ -0,0 +1,152 @@
+import logging
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, joinedload
+
+from dbengine.exceptions import (
+    BatchOperationError,
+    ColumnDeleted,
+    ColumnDoesntExists,
+    ProhibitedActionInBranch,
+    TableDeleted,
+    TableDoesntExists,
+)
+from dbengine.models import AttributeTypes, Branch, BranchState, BranchTypes, DbAttributes, DbColumn, DbEntity
+from dbengine.models.branch import CommitActionTypes
+from .bulk import Change, allocate_ids, write_changes
+
+logger = logging.getLogger(__name__)
+
+
+class Operation(NamedTuple):
+    """One schema edit of batch
+
+    `id` is id of altered or dropped table or column. Objects created in batch get negative `id`
+    given in their create operation, so the following operations can refer to them.
+    `table_id` is table of created column.
+    """
+
+    action: CommitActionTypes
+    type: AttributeTypes
+    id: Optional[int] = None
+    table_id: Optional[int] = None
+    name: Optional[str] = None
+    datatype: Optional[str] = None
+
+
+class _Entity:
+    """Table or column in working view of branch"""
+
+    def __init__(self, type: AttributeTypes, id: int, table_id: int, values: dict, attribute_id=None, deleted=False):
+        self.type, self.id, self.table_id = type, id, table_id
+        self.values, self.attribute_id, self.deleted = values, attribute_id, deleted
+
+    @classmethod
+    def from_attribute(cls, attr: DbAttributes, deleted: bool) -> "_Entity":
+        if attr.type == AttributeTypes.TABLE:
+            return cls(AttributeTypes.TABLE, attr.table_id, attr.table_id, dict(name=attr.name), attr.id, deleted)
+        # Older column attributes have no table_id, their table is taken from the column
+        table_id = attr.table_id or attr.column.table_id
+        values = dict(name=attr.name, datatype=attr.datatype)
+        return cls(AttributeTypes.COLUMN, attr.column_id, table_id, values, attr.id, deleted)
+
+
+def _load_view(branch: Branch, operations: List[Operation], *, session: Session) -> Dict[int, _Entity]:
+    """Load state of entities used by operations together with columns of used tables"""
+    ids = {op.id for op in operations if op.id and op.id > 0} | {
+        op.table_id for op in operations if op.table_id and op.table_id > 0
+    }
+    if not ids:
+        return {}
+    states = (
+        session.query(BranchState)
+        .options(joinedload(BranchState.attribute))
+        .outerjoin(DbColumn, DbColumn.id == BranchState.entity_id)
+        .filter(
+            and_(
+                BranchState.branch_id == branch.id,
+                or_(BranchState.entity_id.in_(ids), DbColumn.table_id.in_(ids)),
+            )
+        )
+        .all()
+    )
+    return {state.entity_id: _Entity.from_attribute(state.attribute, state.deleted) for state in states}
+
+
+def _get_alive(view: Dict[int, _Entity], type: AttributeTypes, id: int, branch: Branch) -> _Entity:
+    entity = view.get(id)
+    if type == AttributeTypes.TABLE:
+        if entity is None or entity.type != AttributeTypes.TABLE:
+            raise TableDoesntExists(id, branch.name)
+        if entity.deleted:
+            raise TableDeleted(id, branch.name)
+    else:
+        if entity is None or entity.type != AttributeTypes.COLUMN:
+            raise ColumnDoesntExists(id, branch.name)
+        if entity.deleted:
+            raise ColumnDeleted(id, branch.name)
+    return entity
+
+
+def apply_batch(branch: Branch, operations: List[Operation], *, session: Session) -> List[Tuple[int, int]]:
+    """Apply ordered list of schema edits to branch in one transaction
+
+    State of branch is loaded once, operations are checked against working view of it and all
+    commits are written together. Returns id of changed object and its last commit for every operation.
+    """
+    logger.debug("apply_batch")
+    if branch.type != BranchTypes.WIP:
+        raise ProhibitedActionInBranch("Batch editing", branch.name)
+    view = _load_view(branch, operations, session=session)
+    creates = sum(op.action == CommitActionTypes.CREATE for op in operations)
+    entity_ids = iter(allocate_ids(DbEntity, creates, session=session))
+    attribute_ids = iter(
+        allocate_ids(DbAttributes, sum(op.action != CommitActionTypes.DROP for op in operations), session=session)
+    )
+    changes, last_changes = [], []
+
+    def commit(entity: _Entity, values: Optional[dict], new_entity: bool = False):
+        attribute_out = None if values is None else dict(values, id=next(attribute_ids))
+        changes.append(Change(entity.type, entity.id, entity.table_id, entity.attribute_id, attribute_out, new_entity))
+        if values is None:
+            entity.deleted = True
+        else:
+            entity.values, entity.attribute_id = values, attribute_out["id"]
+
+    for index, op in enumerate(operations):
+        if op.action == CommitActionTypes.CREATE:
+            if op.id is not None and (op.id >= 0 or op.id in view):
+                raise BatchOperationError(index, "created object may only have unique negative id")
+            if not op.name or (op.type == AttributeTypes.COLUMN and not op.datatype):
+                raise BatchOperationError(index, "name is required, and datatype for columns")
+            id = next(entity_ids)
+            if op.type == AttributeTypes.TABLE:
+                entity = _Entity(AttributeTypes.TABLE, id, id, {})
+                commit(entity, dict(name=op.name), new_entity=True)
+            else:
+                table = _get_alive(view, AttributeTypes.TABLE, op.table_id, branch)
+                entity = _Entity(AttributeTypes.COLUMN, id, table.id, {})
+                commit(entity, dict(name=op.name, datatype=op.datatype), new_entity=True)
+            view[id] = entity
+            if op.id is not None:
+                view[op.id] = entity
+        elif op.action == CommitActionTypes.ALTER:
+            entity = _get_alive(view, op.type, op.id, branch)
+            if op.type == AttributeTypes.TABLE and not op.name:
+                raise BatchOperationError(index, "name of table is required")
+            values = dict(entity.values)
+            values.update({key: value for key, value in (("name", op.name), ("datatype", op.datatype)) if value})
+            commit(entity, values)
+        elif op.action == CommitActionTypes.DROP:
+            entity = _get_alive(view, op.type, op.id, branch)
+            if op.type == AttributeTypes.TABLE:
+                columns = [e for e in view.values() if e.type == AttributeTypes.COLUMN and e.table_id == entity.id]
+                for column in sorted(set(columns), key=lambda e: e.id):
+                    if not column.deleted:
+                        commit(column, None)
+            commit(entity, None)
+        last_changes.append((entity.id, len(changes) - 1))
+
+    written = write_changes(branch, changes, session=session)
+    return [(id, written[change_index][0]) for id, change_index in last_changes]
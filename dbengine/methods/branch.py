@@ -1,5 +1,7 @@
 import logging
+from typing import List
 
+from sqlalchemy import and_, insert, select
 from sqlalchemy.orm import Session
 
 from dbengine.exceptions import (
@@ -11,6 +13,9 @@ from dbengine.exceptions import (
     FatalMigrationError,
 )
 from dbengine.models import Branch, BranchTypes, Commit
+from .bulk import allocate_ids, transaction
+from .checkpoint import get_branch_point, load_branch_state, save_merge_checkpoints
+from .state import advance_head, copy_state, merge_state
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +34,7 @@ def create_main_branch(*, session: Session) -> Branch:
     session.flush()
     new_commit = Commit(branch_id=new_branch.id)
     session.add(new_commit)
+    new_branch.head_commit = new_commit
     session.flush()
     return new_branch
 
@@ -36,18 +42,19 @@ def create_main_branch(*, session: Session) -> Branch:
 def create_branch(name, *, session: Session) -> Branch:
     """Создать новую ветку из головы main ветки.
 
-    Тип ветки WIP, название ветки `name`
+    Тип ветки WIP, название ветки `name`. Состояние схемы копируется из main
     """
     s = session.query(Branch).filter(Branch.type == BranchTypes.MAIN).one_or_none()
     if not s:
         raise BranchError("Main branch does not exists")
-    last_commit = session.query(Commit).filter(Commit.branch_id == 1).order_by(Commit.id.desc()).first()
     new_branch = Branch(name=name, type=BranchTypes.WIP)
     session.add(new_branch)
     session.flush()
-    new_commit = Commit(branch_id=new_branch.id, prev_commit_id=last_commit.id)
+    new_commit = Commit(branch_id=new_branch.id, prev_commit_id=s.head_commit_id)
     session.add(new_commit)
+    new_branch.head_commit = new_commit
     session.flush()
+    copy_state(s, new_branch, session=session)
     logger.debug("create_branch")
     return new_branch
 
@@ -61,20 +68,9 @@ def request_merge_branch(branch: Branch, *, session: Session, test_connector) ->
         raise IncorrectBranchType("request merge", "main")
     if check_conflicts(branch, session=session):
         raise MergeError(branch.id)
-    rollback, upgrade_exception = [], None
     test_connector.generate_migration(branch)
     session.flush()
-    try:
-        rollback = test_connector.upgrade(branch.commits)
-    except MigrationError as e:
-        upgrade_exception = e
-    try:
-        test_connector.downgrade(rollback)
-    except MigrationError:
-        raise FatalMigrationError
-        # TODO: удаляем все запоротые таблицы и создаем их заново
-    if upgrade_exception:
-        raise upgrade_exception
+    migrate(test_connector, branch.own_commits, keep=False)
     branch.type = BranchTypes.MR
     session.flush()
     logger.debug("request_merge_branch")
@@ -106,57 +102,65 @@ def ok_branch(branch: Branch, *, session: Session, test_connector, prod_connecto
         raise MergeError(branch.id)
     prod_connector.generate_migration(branch)
     session.flush()
+    commits = branch.own_commits
+    migrate(test_connector, commits)
+    migrate(prod_connector, commits)
+    main = get_branch(1, session=session)
+    s = list(reversed(commits))
+    new_rows, prev_commit_id = [], main.head_commit_id
+    for new_id, row in zip(allocate_ids(Commit, len(s), session=session), s):
+        new_rows.append(
+            dict(
+                id=new_id,
+                prev_commit_id=prev_commit_id,
+                dev_branch_id=branch.id,
+                branch_id=main.id,
+                attribute_id_in=row.attribute_id_in,
+                attribute_id_out=row.attribute_id_out,
+                table_id=row.table_id,
+                sql_up=row.sql_up,
+                sql_down=row.sql_down,
+                sql_dialect=row.sql_dialect,
+            )
+        )
+        prev_commit_id = new_id
+    with transaction(session):
+        session.execute(insert(Commit), new_rows)
+        save_merge_checkpoints(
+            load_branch_state(main.id, session=session), commits, [row["id"] for row in new_rows], session=session
+        )
+        merge_state(main, commits, session=session)
+        advance_head(main, prev_commit_id, main.head_commit_id, session=session)
+        branch.type = BranchTypes.MERGED
+        session.flush()
+    session.expire(main, ["_commits"])
+
+    logger.debug("ok_branch")
+    return branch
+
+
+def migrate(connector, commits: List[Commit], *, keep: bool = True) -> None:
+    """Применить миграцию коммитов ветки к базе данных
+
+    Если `keep` ложно, миграция только проверяется и откатывается. Базы с транзакционным DDL
+    откатываются сами, в остальных выполняется обратная миграция
+    """
+    if connector.transactional:
+        connector.migrate(commits, commit=keep)
+        return
     rollback, upgrade_exception = [], None
     try:
-        rollback = test_connector.upgrade(branch.commits)
+        rollback = connector.upgrade(commits)
     except MigrationError as e:
         upgrade_exception = e
-    if upgrade_exception:
+    if upgrade_exception or not keep:
         try:
-            test_connector.downgrade(rollback)
+            connector.downgrade(rollback)
         except MigrationError:
             raise FatalMigrationError
             # TODO: удаляем все запоротые таблицы и создаем их заново
-        raise upgrade_exception
-    rollback, upgrade_exception = [], None
-    try:
-        rollback = prod_connector.upgrade(branch.commits)
-    except MigrationError as e:
-        upgrade_exception = e
     if upgrade_exception:
-        try:
-            prod_connector.downgrade(rollback)
-        except MigrationError:
-            raise FatalMigrationError
-            # TODO: удаляем все запоротые таблицы и создаем их заново
         raise upgrade_exception
-    branch.type = BranchTypes.MERGED
-    session.flush()
-    commits_list = []
-    for row in branch.commits:
-        commits_list.append(row)
-        if row.prev_commit.branch.id == 1:
-            break
-    s = session.query(Commit).filter(Commit.branch_id == branch.id).order_by(Commit.id).all()
-    for row in s:
-        new_commit = Commit(
-            dev_branch_id=branch.id,
-            attribute_id_in=row.attribute_id_in,
-            attribute_id_out=row.attribute_id_out,
-            branch_id=1,
-        )
-        if row == s[0]:
-            new_commit.prev_commit_id = row.prev_commit_id
-        else:
-            prev_commit = (
-                session.query(Commit).filter(Commit.dev_branch_id == branch.id).order_by(Commit.id.desc()).first()
-            )
-            new_commit.prev_commit_id = prev_commit.id
-        session.add(new_commit)
-        session.flush()
-
-    logger.debug("ok_branch")
-    return branch
 
 
 def get_branch(id: int, *, session: Session) -> Branch:
@@ -171,23 +175,23 @@ def get_branch(id: int, *, session: Session) -> Branch:
 def check_conflicts(branch: Branch, session: Session):
     """
     Checking conflicts with main branch
+
+    Branch conflicts if main commits made after the branch point touch tables touched in branch
     """
     main = get_branch(1, session=session)
-    entities_changed_branch = set()
-    entities_changed_main = set()
-
-    for c in branch.commits:
-        if (c.attribute_in or c.attribute_out) is not None:
-            entities_changed_branch.add((c.attribute_in or c.attribute_out).table.id)
-        if c.prev_commit.id == main.id:
-            break
-    for c in main.commits:
-        if main.last_commit.id == branch.first_commit.prev_commit.id:
-            break
-        if (c.attribute_in or c.attribute_out) is not None:
-            entities_changed_main.add((c.attribute_in or c.attribute_out).table.id)
-        if c.prev_commit.id == branch.first_commit.prev_commit.id:
-            break
-    if len(entities_changed_branch & entities_changed_main) == 0:
-        return False
-    return True
+    branch_point_id = get_branch_point(branch.id, session=session)
+    tables_changed_branch = select(Commit.table_id).where(
+        and_(Commit.branch_id == branch.id, Commit.table_id.isnot(None))
+    )
+    conflict = (
+        session.query(Commit.id)
+        .filter(
+            and_(
+                Commit.branch_id == main.id,
+                Commit.id > branch_point_id,
+                Commit.table_id.in_(tables_changed_branch),
+            )
+        )
+        .first()
+    )
+    return conflict is not None
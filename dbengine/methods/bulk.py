@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from dbengine.models import AttributeTypes, Branch, Commit, DbAttributes, DbColumn, DbColumnAttributes, DbTable
+from dbengine.models import DbTableAttributes
+from .state import advance_head, upsert_state
+
+
+class Change(NamedTuple):
+    """Change of one table or column to be committed in bulk
+
+    `attribute_in` is id of current attributes of entity, `attribute_out` are values of its new
+    attributes or None if entity is deleted, id of new attributes is allocated unless given in values.
+    `new_entity` tells that entity has to be created.
+    """
+
+    type: AttributeTypes
+    entity_id: int
+    table_id: int
+    attribute_in: Optional[int] = None
+    attribute_out: Optional[dict] = None
+    new_entity: bool = False
+
+
+@contextmanager
+def transaction(session: Session):
+    """Run block in one transaction, joining the current one if session has it"""
+    if session.in_transaction():
+        yield
+    else:
+        with session.begin():
+            yield
+
+
+def allocate_ids(model, count: int, *, session: Session) -> List[int]:
+    """Reserve `count` primary keys of model from its sequence with one query
+
+    Models with joined inheritance take keys from the sequence of their base table
+    """
+    if count == 0:
+        return []
+    table = inspect(model).base_mapper.local_table
+    sequence = func.pg_get_serial_sequence(table.name, "id")
+    query = select(func.nextval(sequence)).select_from(func.generate_series(1, count))
+    return [row[0] for row in session.execute(query)]
+
+
+def write_changes(branch: Branch, changes: List[Change], *, session: Session) -> List[Tuple[int, Optional[int]]]:
+    """Commit changes to branch one by one with a few multi-row statements
+
+    Ids of new entities are expected to be allocated by caller. Every change gets its own commit,
+    commits are chained after the branch head, branch state and head are updated in the same transaction,
+    BranchHeadMoved is raised if head was moved by other writer.
+    Returns commit id and new attributes id of every change.
+    """
+    if not changes:
+        return []
+    tables, columns, table_attrs, column_attrs, out_ids = [], [], [], [], []
+    attribute_ids = iter(
+        allocate_ids(
+            DbAttributes,
+            sum(c.attribute_out is not None and "id" not in c.attribute_out for c in changes),
+            session=session,
+        )
+    )
+    for change in changes:
+        if change.new_entity and change.type == AttributeTypes.TABLE:
+            tables.append(dict(id=change.entity_id, type=AttributeTypes.TABLE))
+        elif change.new_entity:
+            columns.append(dict(id=change.entity_id, type=AttributeTypes.COLUMN, table_id=change.table_id))
+        if change.attribute_out is None:
+            out_ids.append(None)
+            continue
+        values = dict(change.attribute_out)
+        out_ids.append(values.pop("id", None) or next(attribute_ids))
+        if change.type == AttributeTypes.TABLE:
+            table_attrs.append(dict(id=out_ids[-1], type=AttributeTypes.TABLE, table_id=change.entity_id, **values))
+        else:
+            column_attrs.append(
+                dict(
+                    id=out_ids[-1],
+                    type=AttributeTypes.COLUMN,
+                    column_id=change.entity_id,
+                    table_id=change.table_id,
+                    **values,
+                )
+            )
+    commit_ids = allocate_ids(Commit, len(changes), session=session)
+    commits, state, prev_commit_id = [], {}, branch.head_commit_id
+    for change, commit_id, out_id in zip(changes, commit_ids, out_ids):
+        commits.append(
+            dict(
+                id=commit_id,
+                prev_commit_id=prev_commit_id,
+                branch_id=branch.id,
+                attribute_id_in=change.attribute_in,
+                attribute_id_out=out_id,
+                table_id=change.table_id,
+            )
+        )
+        state[change.entity_id] = (out_id or change.attribute_in, out_id is None)
+        prev_commit_id = commit_id
+    with transaction(session):
+        session.bulk_insert_mappings(DbTable, tables)
+        session.bulk_insert_mappings(DbColumn, columns)
+        session.bulk_insert_mappings(DbTableAttributes, table_attrs)
+        session.bulk_insert_mappings(DbColumnAttributes, column_attrs)
+        session.execute(insert(Commit), commits)
+        upsert_state(branch, state, session=session)
+        advance_head(branch, prev_commit_id, commits[0]["prev_commit_id"], session=session)
+    return list(zip(commit_ids, out_ids))
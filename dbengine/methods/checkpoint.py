@@ -0,0 +1,106 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from dbengine.models import Branch, BranchState, Commit, SchemaCheckpoint
+from .graph import commit_graph, replay_chain
+from .state import replay_state
+
+logger = logging.getLogger(__name__)
+
+MAIN_BRANCH_ID = 1
+CHECKPOINT_INTERVAL = 100
+"""Number of main commits between checkpoints written inside one merge"""
+
+State = Dict[int, Tuple[int, bool]]
+
+
+def get_branch_point(branch_id: int, *, session: Session) -> Optional[int]:
+    """Return id of main commit the branch was created from"""
+    return (
+        session.query(Commit.prev_commit_id).filter(Commit.branch_id == branch_id).order_by(Commit.id).limit(1).scalar()
+    )
+
+
+def in_branch(branch: Branch, commit: Commit, *, session: Session) -> bool:
+    """Check that commit is in history of branch
+
+    History of branch is its own commits and main commits up to the branch point, main history is linear
+    """
+    if commit.branch_id == branch.id:
+        return True
+    if commit.branch_id != MAIN_BRANCH_ID:
+        return False
+    branch_point_id = get_branch_point(branch.id, session=session)
+    return branch_point_id is not None and commit.id <= branch_point_id
+
+
+def load_branch_state(branch_id: int, *, session: Session) -> State:
+    rows = session.query(BranchState.entity_id, BranchState.attribute_id, BranchState.deleted).filter(
+        BranchState.branch_id == branch_id
+    )
+    return {entity_id: (attribute_id, deleted) for entity_id, attribute_id, deleted in rows}
+
+
+def save_checkpoint(commit_id: int, state: State, *, session: Session) -> SchemaCheckpoint:
+    checkpoint = SchemaCheckpoint(
+        commit_id=commit_id,
+        state=[[entity_id, attribute_id, deleted] for entity_id, (attribute_id, deleted) in sorted(state.items())],
+    )
+    session.add(checkpoint)
+    return checkpoint
+
+
+def save_merge_checkpoints(
+    state: State, commits: List[Commit], commit_ids: List[int], *, session: Session, interval: Optional[int] = None
+) -> None:
+    """Write checkpoints of main after replaying merged commits onto it
+
+    `state` is main state before the merge, `commits` are merged commits, newest first, and
+    `commit_ids` are ids of their copies on main, oldest first. Checkpoint is written every
+    `interval` replayed commits and after the last one.
+    """
+    interval = interval or CHECKPOINT_INTERVAL
+    state = dict(state)
+    for position, (commit, commit_id) in enumerate(zip(reversed(commits), commit_ids), 1):
+        attr_in, attr_out = commit.attribute_in, commit.attribute_out
+        if attr_out is not None:
+            state[attr_out.entity_id] = (attr_out.id, False)
+        elif attr_in is not None:
+            state[attr_in.entity_id] = (attr_in.id, True)
+        if position % interval == 0 or position == len(commit_ids):
+            save_checkpoint(commit_id, state, session=session)
+
+
+def resolve_state(commit: Commit, *, session: Session) -> State:
+    """Return entity id -> (attributes id, deleted) state at commit
+
+    Replay starts from the nearest checkpoint below commit. Checkpoints are made on main only,
+    so for other branches it is the nearest one at or before the branch point.
+    """
+    main_commit_id = commit.id
+    if commit.branch_id != MAIN_BRANCH_ID:
+        main_commit_id = get_branch_point(commit.branch_id, session=session)
+    checkpoint = None
+    if main_commit_id is not None:
+        checkpoint_id = (
+            session.query(func.max(SchemaCheckpoint.commit_id))
+            .filter(SchemaCheckpoint.commit_id <= main_commit_id)
+            .scalar()
+        )
+        checkpoint = checkpoint_id and session.query(SchemaCheckpoint).get(checkpoint_id)
+    state = {}
+    if checkpoint:
+        state = {entity_id: (attribute_id, deleted) for entity_id, attribute_id, deleted in checkpoint.state}
+    until_id = checkpoint.commit_id if checkpoint else None
+    if commit.id == until_id:
+        return state
+    chain = commit_graph.chain(session, commit.id, until_id=until_id)
+    if chain is not None:
+        state.update(replay_chain(chain))
+    else:
+        replayed = replay_state(commit.ancestry(until_id=until_id))
+        state.update({entity_id: (attr.id, deleted) for entity_id, (attr, deleted) in replayed.items()})
+    return state
@@ -3,10 +3,14 @@ from typing import List, Optional, Tuple
 
 import sqlalchemy.exc
 from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, object_session
 
 from dbengine.exceptions import ColumnDeleted, ColumnDoesntExists, ProhibitedActionInBranch
-from dbengine.models import AttributeTypes, Branch, BranchTypes, Commit, DbColumn, DbColumnAttributes, DbTable
+from dbengine.models import AttributeTypes, Branch, BranchTypes, Commit, DbAttributes, DbColumn, DbColumnAttributes
+from dbengine.models import DbTable
+from .checkpoint import in_branch, resolve_state
+from .bulk import transaction
+from .state import advance_head, get_state, set_state
 
 logger = logging.getLogger(__name__)
 
@@ -18,21 +22,23 @@ def create_column(
     logging.debug('create_column')
     if branch.type != BranchTypes.WIP:
         raise ProhibitedActionInBranch("Column creating", branch.name)
-    s = session.query(Commit).filter(Commit.branch_id == branch.id).order_by(Commit.id.desc()).first()
-    new_commit = Commit(branch_id=branch.id, attribute_id_in=None)
-    if s:
-        new_commit.prev_commit_id = s.id
-    new_column = DbColumn(type=AttributeTypes.COLUMN, table_id=table.id)
-    session.add(new_column)
-    session.flush()
-    new_column_attribute = DbColumnAttributes(
-        type=AttributeTypes.COLUMN, column_id=new_column.id, datatype=datatype, name=name, table_id=table.id
-    )
-    session.add(new_column_attribute)
-    session.flush()
-    new_commit.attribute_id_out = new_column_attribute.id
-    session.add(new_commit)
-    session.flush()
+    new_commit = Commit(branch_id=branch.id, attribute_id_in=None, table_id=table.id)
+    new_commit.prev_commit_id = branch.head_commit_id
+    with transaction(session):
+        new_column = DbColumn(type=AttributeTypes.COLUMN, table_id=table.id)
+        session.add(new_column)
+        session.flush()
+        new_column_attribute = DbColumnAttributes(
+            type=AttributeTypes.COLUMN, column_id=new_column.id, datatype=datatype, name=name, table_id=table.id
+        )
+        session.add(new_column_attribute)
+        session.flush()
+        new_commit.attribute_id_out = new_column_attribute.id
+        session.add(new_commit)
+        session.flush()
+        advance_head(branch, new_commit.id, new_commit.prev_commit_id, session=session)
+        set_state(branch, new_column_attribute, session=session)
+        session.flush()
 
     return new_column, new_column_attribute, new_commit
 
@@ -40,22 +46,27 @@ def create_column(
 def get_column(
     branch: Branch, id: int, start_from_commit: Optional[Commit] = None
 ) -> Tuple[DbColumn, DbColumnAttributes]:
-    """Return column and last attributes in branch by id"""
-    commit = branch.last_commit
-    attr_out: DbColumnAttributes
-    if start_from_commit and start_from_commit in branch.commits:
-        commit = start_from_commit
-    for row in branch.commits_from(commit):
-        attr_out, attr_in = row.attribute_out, row.attribute_in
-        if attr_in is not None and attr_out is None:
-            if attr_in and attr_in.type == AttributeTypes.COLUMN:
-                if attr_in.column_id == id:
-                    raise ColumnDeleted(id, branch.name)
-        elif (attr_in is not None and attr_out is not None) or (attr_in is None and attr_out is not None):
-            if attr_out and attr_out.type == AttributeTypes.COLUMN:
-                if attr_out.column_id == id:
-                    return (attr_out.column, attr_out)
-    raise ColumnDoesntExists(id, branch.name)
+    """Return column and last attributes in branch by id
+
+    Current attributes are read from branch state, attributes at `start_from_commit` are resolved from checkpoint
+    """
+    if start_from_commit is None:
+        state = get_state(branch, id)
+        if state is None or state.attribute.type != AttributeTypes.COLUMN:
+            raise ColumnDoesntExists(id, branch.name)
+        if state.deleted:
+            raise ColumnDeleted(id, branch.name)
+        return state.attribute.column, state.attribute
+    session = object_session(branch)
+    if not in_branch(branch, start_from_commit, session=session):
+        start_from_commit = branch.head_commit
+    found = resolve_state(start_from_commit, session=session).get(id)
+    attr = found and session.query(DbAttributes).get(found[0])
+    if not attr or attr.type != AttributeTypes.COLUMN:
+        raise ColumnDoesntExists(id, branch.name)
+    if found[1]:
+        raise ColumnDeleted(id, branch.name)
+    return attr.column, attr
 
 
 def update_column(
@@ -73,18 +84,26 @@ def update_column(
     column_and_attributes = get_column(branch, column.id)
     if branch.type != BranchTypes.WIP:
         raise ProhibitedActionInBranch("Column altering", branch.name)
-    s = session.query(Commit).filter(Commit.branch_id == branch.id).order_by(Commit.id.desc()).first()
-    new_commit = Commit(branch_id=branch.id, attribute_id_in=column_and_attributes[1].id)
-    if s:
-        new_commit.prev_commit_id = s.id
+    new_commit = Commit(
+        branch_id=branch.id, attribute_id_in=column_and_attributes[1].id, table_id=column_and_attributes[0].table_id
+    )
+    new_commit.prev_commit_id = branch.head_commit_id
     new_column_attribute = DbColumnAttributes(
-        type=AttributeTypes.COLUMN, column_id=column_and_attributes[0].id, datatype=datatype, name=name
+        type=AttributeTypes.COLUMN,
+        column_id=column_and_attributes[0].id,
+        table_id=column_and_attributes[0].table_id,
+        datatype=datatype,
+        name=name,
     )
-    session.add(new_column_attribute)
-    session.flush()
-    new_commit.attribute_id_out = new_column_attribute.id
-    session.add(new_commit)
-    session.flush()
+    with transaction(session):
+        session.add(new_column_attribute)
+        session.flush()
+        new_commit.attribute_id_out = new_column_attribute.id
+        session.add(new_commit)
+        session.flush()
+        advance_head(branch, new_commit.id, new_commit.prev_commit_id, session=session)
+        set_state(branch, new_column_attribute, session=session)
+        session.flush()
     return column_and_attributes[0], new_column_attribute, new_commit
 
 
@@ -96,12 +115,19 @@ def delete_column(branch: Branch, column: DbColumn, *, session: Session) -> Comm
     column_and_attributes = get_column(branch, column.id)
     if branch.type != BranchTypes.WIP:
         raise ProhibitedActionInBranch("Column deleting", branch.name)
-    s = session.query(Commit).filter(Commit.branch_id == branch.id).order_by(Commit.id.desc()).first()
-    new_commit = Commit(branch_id=branch.id, attribute_id_in=column_and_attributes[1].id, attribute_id_out=None)
-    if s:
-        new_commit.prev_commit_id = s.id
-    session.add(new_commit)
-    session.flush()
+    new_commit = Commit(
+        branch_id=branch.id,
+        attribute_id_in=column_and_attributes[1].id,
+        attribute_id_out=None,
+        table_id=column_and_attributes[0].table_id,
+    )
+    new_commit.prev_commit_id = branch.head_commit_id
+    with transaction(session):
+        session.add(new_commit)
+        session.flush()
+        advance_head(branch, new_commit.id, new_commit.prev_commit_id, session=session)
+        set_state(branch, column_and_attributes[1], deleted=True, session=session)
+        session.flush()
     return new_commit
 
 
@@ -111,9 +137,7 @@ def get_columns(branch: Branch, table: DbTable, session: Session) -> List[int]:
     """
     try:
         ids = []
-        commit_in_branch = (
-            session.query(Commit).filter(Commit.branch_id == branch.id).order_by(Commit.id.desc()).first()
-        )
+        commit_in_branch = branch.last_commit
         prev_commit = commit_in_branch.prev_commit_id
         while True:
             if not prev_commit:
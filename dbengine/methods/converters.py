@@ -1,4 +1,13 @@
-from dbengine.models.entity import DbTable, DbTableAttributes, DbColumnAttributes, DbColumn
+from typing import Iterable, List
+
+from dbengine.models.entity import (
+    AttributeTypes,
+    DbAttributes,
+    DbColumn,
+    DbColumnAttributes,
+    DbTable,
+    DbTableAttributes,
+)
 
 
 def table_aggregator(table: DbTable, attr: DbTableAttributes) -> dict:
@@ -13,3 +22,51 @@ def column_aggregator(column: DbColumn, attr: DbColumnAttributes) -> dict:
     Converting Database column format to user-friendly format
     """
     return {"id": column.id, "table_id": column.table_id, "name": attr.name, "datatype": attr.datatype}
+
+
+def attribute_aggregator(attr: DbAttributes) -> dict:
+    """
+    Converting attributes of table or column to user-friendly format
+    """
+    if attr.type == AttributeTypes.TABLE:
+        return {"id": attr.table_id, "name": attr.name}
+    return {"id": attr.column_id, "table_id": attr.table_id, "name": attr.name, "datatype": attr.datatype}
+
+
+def diff_aggregator(diff) -> dict:
+    """
+    Converting schema diff to added, removed and altered tables and columns
+    """
+    result = {}
+    for type, key in ((AttributeTypes.TABLE, "tables"), (AttributeTypes.COLUMN, "columns")):
+        result[key] = {
+            "added": [attribute_aggregator(attr) for attr in diff.added if attr.type == type],
+            "removed": [attribute_aggregator(attr) for attr in diff.removed if attr.type == type],
+            "altered": [
+                {"before": attribute_aggregator(old), "after": attribute_aggregator(new)}
+                for old, new in diff.altered
+                if old.type == type
+            ],
+        }
+    return result
+
+
+def schema_aggregator(attrs: Iterable[DbAttributes]) -> List[dict]:
+    """
+    Converting attributes of tables and columns to list of tables with embedded columns
+
+    Older column attributes have no table_id, their table is taken from the column
+    """
+    tables, columns = {}, []
+    for attr in attrs:
+        if attr.type == AttributeTypes.TABLE:
+            tables[attr.table_id] = {"id": attr.table_id, "name": attr.name, "columns": []}
+        elif attr.type == AttributeTypes.COLUMN:
+            columns.append(attr)
+    for attr in sorted(columns, key=lambda c: c.column_id):
+        table_id = attr.table_id or attr.column.table_id
+        if table_id in tables:
+            tables[table_id]["columns"].append(
+                {"id": attr.column_id, "table_id": table_id, "name": attr.name, "datatype": attr.datatype}
+            )
+    return [tables[table_id] for table_id in sorted(tables)]
@@ -0,0 +1,70 @@
+import logging
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from dbengine.models import Commit, DbAttributes
+from .graph import commit_graph
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaDiff(NamedTuple):
+    """Difference of schema at `head` from schema at `base`
+
+    `commits` are commits from the common ancestor to head, newest first
+    """
+
+    ancestor_id: Optional[int]
+    added: List[DbAttributes]
+    removed: List[DbAttributes]
+    altered: List[Tuple[DbAttributes, DbAttributes]]
+    commits: List[Commit]
+
+
+def _changes(commits: List[Commit]) -> Tuple[Dict[int, Optional[DbAttributes]], Dict[int, Optional[DbAttributes]]]:
+    """Return attributes of entities after and before commits, newest first, None if entity doesn't exist"""
+    after, before = {}, {}
+    for commit in commits:
+        attr = commit.attribute_out or commit.attribute_in
+        if attr is None:
+            continue
+        after.setdefault(attr.entity_id, commit.attribute_out)
+        before[attr.entity_id] = commit.attribute_in
+    return after, before
+
+
+def _same(first: DbAttributes, second: DbAttributes) -> bool:
+    return first.id == second.id or (first.name, getattr(first, "datatype", None)) == (
+        second.name,
+        getattr(second, "datatype", None),
+    )
+
+
+def get_diff(base: Commit, head: Commit, *, session: Session) -> SchemaDiff:
+    """Compare schemas at two commits
+
+    Only commits after the common ancestor of `base` and `head` are read. Entity changed on one side
+    only has the same attributes at the other side as before its first change.
+    """
+    logger.debug("get_diff")
+    ancestor_id = commit_graph.common_ancestor(session, base.id, head.id)
+    if ancestor_id is None:
+        base_ids = {commit.id for commit in base.ancestry()}
+        ancestor_id = next((commit.id for commit in head.ancestry() if commit.id in base_ids), 0)
+    ancestor_id = ancestor_id or None
+    base_after, base_before = _changes(base.ancestry(until_id=ancestor_id))
+    commits = head.ancestry(until_id=ancestor_id)
+    head_after, head_before = _changes(commits)
+
+    added, removed, altered = [], [], []
+    for entity_id in sorted(base_after.keys() | head_after.keys()):
+        old = base_after[entity_id] if entity_id in base_after else head_before[entity_id]
+        new = head_after[entity_id] if entity_id in head_after else base_before[entity_id]
+        if old is None and new is not None:
+            added.append(new)
+        elif old is not None and new is None:
+            removed.append(old)
+        elif old is not None and not _same(old, new):
+            altered.append((old, new))
+    return SchemaDiff(ancestor_id, added, removed, altered, commits)
@@ -0,0 +1,221 @@
+import logging
+from array import array
+from bisect import bisect_left
+from threading import RLock
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+
+from dbengine.models import AttributeTypes, Commit, DbAttributes, DbColumnAttributes, DbTableAttributes
+from dbengine.models.branch import CommitActionTypes
+
+logger = logging.getLogger(__name__)
+
+NONE = 0
+KINDS = [None, AttributeTypes.TABLE, AttributeTypes.COLUMN]
+ACTIONS = [None, CommitActionTypes.CREATE, CommitActionTypes.ALTER, CommitActionTypes.DROP]
+FIELDS = ("id", "prev", "branch", "attr_in", "attr_out", "kind", "action", "table", "entity")
+
+
+class Chain(NamedTuple):
+    """Snapshot of commits of one chain, newest first, as parallel arrays
+
+    Missing values are stored as 0, `kind` and `action` are indexes in KINDS and ACTIONS.
+    """
+
+    id: array
+    prev: array
+    branch: array
+    attr_in: array
+    attr_out: array
+    kind: array
+    action: array
+    table: array
+    entity: array
+
+
+class CommitGraph:
+    """
+    Compact in-process copy of commit graph
+
+    Commits never change after they are written, so the copy is loaded lazily and only extended
+    with new commits. It is kept as parallel integer arrays sorted by commit id, which is
+    much smaller and faster to walk than ORM objects.
+
+    Fields:
+    max_size: int
+        Number of commits kept, the oldest ones are dropped above it and walks reaching them return None
+    """
+
+    def __init__(self, max_size: int = 1_000_000):
+        self.max_size = max_size
+        self.__lock = RLock()
+        self.__floor = 0
+        self.__loaded = False
+        self.__arrays: Dict[str, array] = {}
+        self.clear()
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__arrays = {name: array("i") for name in FIELDS}
+            self.__floor = 0
+            self.__loaded = False
+
+    def __len__(self) -> int:
+        return len(self.__arrays["id"])
+
+    @staticmethod
+    def __query():
+        attr = DbAttributes.__table__
+        table_attr = DbTableAttributes.__table__
+        column_attr = DbColumnAttributes.__table__
+        attribute_id = func.coalesce(Commit.attribute_id_out, Commit.attribute_id_in)
+        return (
+            select(
+                Commit.id,
+                Commit.prev_commit_id,
+                Commit.branch_id,
+                Commit.attribute_id_in,
+                Commit.attribute_id_out,
+                attr.c.type,
+                Commit.table_id,
+                func.coalesce(column_attr.c.column_id, table_attr.c.table_id),
+            )
+            .outerjoin(attr, attr.c.id == attribute_id)
+            .outerjoin(table_attr, table_attr.c.id == attr.c.id)
+            .outerjoin(column_attr, column_attr.c.id == attr.c.id)
+        )
+
+    def __position(self, commit_id: int) -> int:
+        ids = self.__arrays["id"]
+        position = bisect_left(ids, commit_id)
+        if position < len(ids) and ids[position] == commit_id:
+            return position
+        return -1
+
+    def __add(self, rows: Iterable[tuple]) -> None:
+        arrays = self.__arrays
+        for id, prev, branch, attr_in, attr_out, type, table, entity in rows:
+            if self.__position(id) >= 0:
+                continue
+            if attr_out is None and attr_in is None:
+                action = None
+            elif attr_out is None:
+                action = CommitActionTypes.DROP
+            elif attr_in is None:
+                action = CommitActionTypes.CREATE
+            else:
+                action = CommitActionTypes.ALTER
+            kind = AttributeTypes(type) if type is not None else None
+            values = (id, prev, branch, attr_in, attr_out, KINDS.index(kind), ACTIONS.index(action), table, entity)
+            position = bisect_left(arrays["id"], id)
+            for name, value in zip(FIELDS, values):
+                if position == len(arrays[name]):
+                    arrays[name].append(value or NONE)
+                else:
+                    arrays[name].insert(position, value or NONE)
+        extra = len(self) - self.max_size
+        if extra > 0:
+            for name in FIELDS:
+                del arrays[name][:extra]
+            self.__floor = arrays["id"][0]
+
+    def load(self, session: Session, missing: Iterable[int] = ()) -> None:
+        """Load new commits and given `missing` ones
+
+        Ids are allocated before commits are written, so commits with ids below the newest loaded
+        one can appear later. They are fetched as `missing` once a walk meets them.
+        """
+        with self.__lock:
+            query = self.__query()
+            if not self.__loaded:
+                rows = session.execute(query.order_by(Commit.id.desc()).limit(self.max_size)).all()
+                self.__add(reversed(rows))
+                if len(rows) == self.max_size:
+                    self.__floor = rows[-1][0]
+                self.__loaded = True
+                logger.debug("Commit graph loaded with %d commits", len(rows))
+                return
+            ids = self.__arrays["id"]
+            missing = [id for id in missing if id > self.__floor]
+            condition = Commit.id > ids[-1] if ids else Commit.id > 0
+            if missing:
+                condition = or_(condition, Commit.id.in_(missing))
+            self.__add(session.execute(query.where(condition).order_by(Commit.id)).all())
+
+    def chain(
+        self, session: Session, head_id: int, *, branch_id: Optional[int] = None, until_id: Optional[int] = None
+    ) -> Optional[Chain]:
+        """Return commit with `head_id` and its ancestors, newest first
+
+        Same walk as `Commit.ancestry`. Returns None if the chain is not fully known in process,
+        callers fall back to the database then.
+        """
+        with self.__lock:
+            positions = self.__walk(session, head_id, branch_id, until_id)
+            if positions is None:
+                return None
+            return Chain(*(array("i", (self.__arrays[name][p] for p in positions)) for name in FIELDS))
+
+    def common_ancestor(self, session: Session, first_id: int, second_id: int) -> Optional[int]:
+        """Return id of the newest commit in history of both commits, 0 if they have none
+
+        Both chains are walked one step at a time, so only commits after the common ancestor are visited.
+        Returns None if the chains are not fully known in process.
+        """
+        with self.__lock:
+            if not self.__loaded:
+                self.load(session)
+            tips, seen = [first_id, second_id], (set(), set())
+            while tips[0] != NONE or tips[1] != NONE:
+                for side in (0, 1):
+                    commit_id = tips[side]
+                    if commit_id == NONE:
+                        continue
+                    if commit_id in seen[1 - side]:
+                        return commit_id
+                    seen[side].add(commit_id)
+                    position = self.__find(session, commit_id)
+                    if position < 0:
+                        return None
+                    tips[side] = self.__arrays["prev"][position]
+            return NONE
+
+    def __find(self, session: Session, commit_id: int) -> int:
+        """Return position of commit, loading it if needed, or -1 if it can't be known"""
+        position = self.__position(commit_id)
+        if position < 0 and commit_id > self.__floor:
+            self.load(session, missing=[commit_id])
+            position = self.__position(commit_id)
+        return position
+
+    def __walk(
+        self, session: Session, head_id: int, branch_id: Optional[int], until_id: Optional[int]
+    ) -> Optional[List[int]]:
+        if not self.__loaded:
+            self.load(session)
+        arrays, ids, commit_id = self.__arrays, [], head_id
+        while commit_id != NONE and commit_id != until_id:
+            position = self.__find(session, commit_id)
+            if position < 0:
+                return None
+            if branch_id is not None and arrays["branch"][position] != branch_id:
+                break
+            ids.append(commit_id)
+            commit_id = arrays["prev"][position]
+        # Loading missing commits moves walked ones in arrays
+        positions = [self.__position(id) for id in ids]
+        return None if -1 in positions else positions
+
+
+def replay_chain(chain: Chain) -> Dict[int, Tuple[int, bool]]:
+    """Fold chain, newest first, into entity id -> (last attributes id, deleted) mapping"""
+    state = {}
+    for entity, attr_in, attr_out in zip(chain.entity, chain.attr_in, chain.attr_out):
+        if entity != NONE and entity not in state:
+            state[entity] = (attr_out or attr_in, attr_out == NONE)
+    return state
+
+
+commit_graph = CommitGraph()
@@ -0,0 +1,87 @@
+import logging
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+from dbengine.exceptions import MergeJobAlreadyQueued, MergeJobNotFoundError
+from dbengine.models import Branch, MergeJob, MergeJobActions, MergeJobStatuses
+from .branch import get_branch, ok_branch, request_merge_branch
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED_STATUSES = (MergeJobStatuses.QUEUED, MergeJobStatuses.RUNNING)
+
+
+def create_merge_job(branch: Branch, action: MergeJobActions, *, session: Session) -> MergeJob:
+    """Queue merge request or approve of branch
+
+    Branch can have only one unfinished job at a time
+    """
+    logger.debug("create_merge_job")
+    unfinished = (
+        session.query(MergeJob)
+        .filter(and_(MergeJob.branch_id == branch.id, MergeJob.status.in_(UNFINISHED_STATUSES)))
+        .first()
+    )
+    if unfinished:
+        raise MergeJobAlreadyQueued(branch.id)
+    job = MergeJob(branch_id=branch.id, action=action, status=MergeJobStatuses.QUEUED)
+    session.add(job)
+    session.flush()
+    return job
+
+
+def get_merge_job(id: int, *, session: Session) -> MergeJob:
+    """Return merge job by id"""
+    result = session.query(MergeJob).filter(MergeJob.id == id).one_or_none()
+    if not result:
+        raise MergeJobNotFoundError(id)
+    return result
+
+
+def get_merge_jobs(branch: Branch, *, session: Session) -> List[MergeJob]:
+    """Return all merge jobs of branch, newest first"""
+    return session.query(MergeJob).filter(MergeJob.branch_id == branch.id).order_by(MergeJob.id.desc()).all()
+
+
+def run_merge_job(id: int, *, session: Session, test_connector, prod_connector) -> MergeJob:
+    """Run queued merge job and record its result
+
+    Errors of merge are not raised, they are saved to the job
+    """
+    logger.debug("run_merge_job")
+    job = get_merge_job(id, session=session)
+    job.status, job.start_ts = MergeJobStatuses.RUNNING, datetime.utcnow()
+    session.flush()
+    try:
+        branch = get_branch(job.branch_id, session=session)
+        if job.action == MergeJobActions.REQUEST:
+            request_merge_branch(branch, session=session, test_connector=test_connector)
+        else:
+            ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+    except Exception as e:
+        logger.error("Merge job %d failed", id, exc_info=True)
+        job.status, job.error = MergeJobStatuses.FAILED, str(e) or type(e).__name__
+    else:
+        job.status = MergeJobStatuses.DONE
+    job.finish_ts = datetime.utcnow()
+    session.flush()
+    return job
+
+
+def fail_unfinished_merge_jobs(*, session: Session) -> int:
+    """Mark jobs left queued or running by stopped process as failed
+
+    Jobs run inside the process, so on start none of them can be alive. Without this the branch
+    of interrupted job could never be merged again. Returns number of failed jobs.
+    """
+    logger.debug("fail_unfinished_merge_jobs")
+    jobs = session.query(MergeJob).filter(MergeJob.status.in_(UNFINISHED_STATUSES)).all()
+    for job in jobs:
+        logger.warning("Merge job %d of branch %d was interrupted", job.id, job.branch_id)
+        job.status, job.error = MergeJobStatuses.FAILED, "Interrupted by restart of service"
+        job.finish_ts = datetime.utcnow()
+    session.flush()
+    return len(jobs)
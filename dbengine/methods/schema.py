@@ -0,0 +1,65 @@
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import and_
+from sqlalchemy.orm import object_session
+
+from dbengine.exceptions import CommitNotFoundError
+from dbengine.models import Branch, BranchState, Commit, DbAttributes
+from .checkpoint import MAIN_BRANCH_ID, get_branch_point, in_branch, resolve_state
+
+logger = logging.getLogger(__name__)
+
+
+def get_schema(branch: Branch, start_from_commit: Optional[Commit] = None) -> List[DbAttributes]:
+    """Return last attributes of all alive tables and columns in branch
+
+    Current schema is read from branch state with one query, schema at `start_from_commit`
+    is resolved from the nearest checkpoint below it
+    """
+    logger.debug("get_schema")
+    if start_from_commit is None:
+        return (
+            object_session(branch)
+            .query(DbAttributes)
+            .join(BranchState, BranchState.attribute_id == DbAttributes.id)
+            .filter(and_(BranchState.branch_id == branch.id, BranchState.deleted.is_(False)))
+            .all()
+        )
+    session = object_session(branch)
+    state = resolve_state(start_from_commit, session=session)
+    alive = [attribute_id for attribute_id, deleted in state.values() if not deleted]
+    return session.query(DbAttributes).filter(DbAttributes.id.in_(alive)).all()
+
+
+def get_commit(branch: Branch, commit_id: int) -> Commit:
+    """Return commit of branch history by id"""
+    session = object_session(branch)
+    commit = session.query(Commit).get(commit_id)
+    if commit is None or not in_branch(branch, commit, session=session):
+        raise CommitNotFoundError(str(commit_id), branch.name)
+    return commit
+
+
+def get_commit_at(branch: Branch, at: datetime) -> Commit:
+    """Return last commit of branch history made at or before `at`
+
+    Own commits of branch are newer than main commits of its history, so they are looked up first.
+    Both lookups are single index scans.
+    """
+    session = object_session(branch)
+    parts = [Commit.branch_id == branch.id]
+    branch_point_id = get_branch_point(branch.id, session=session)
+    if branch.id != MAIN_BRANCH_ID and branch_point_id is not None:
+        parts.append(and_(Commit.branch_id == MAIN_BRANCH_ID, Commit.id <= branch_point_id))
+    for history in parts:
+        commit = (
+            session.query(Commit)
+            .filter(and_(history, Commit.create_ts <= at))
+            .order_by(Commit.create_ts.desc(), Commit.id.desc())
+            .first()
+        )
+        if commit is not None:
+            return commit
+    raise CommitNotFoundError(f"at {at.isoformat()}", branch.name)
@@ -0,0 +1,124 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, joinedload, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from dbengine.exceptions import BranchHeadMoved
+from dbengine.models import Branch, BranchState, Commit, DbAttributes, DbColumn
+
+logger = logging.getLogger(__name__)
+
+
+def advance_head(branch: Branch, commit_id: int, expected_id: Optional[int], *, session: Session) -> None:
+    """Move head of branch to `commit_id` only if it still points to `expected_id`
+
+    Commits are chained after the head they have read, so if other writer moved the head in between
+    BranchHeadMoved is raised instead of forking the history. Expected to run in the transaction
+    which inserted the commit, so it is rolled back too.
+    """
+    head = Branch.head_commit_id == expected_id if expected_id is not None else Branch.head_commit_id.is_(None)
+    query = update(Branch).where(and_(Branch.id == branch.id, head)).values(head_commit_id=commit_id)
+    if session.execute(query.execution_options(synchronize_session=False)).rowcount == 0:
+        raise BranchHeadMoved(branch.id)
+    set_committed_value(branch, "head_commit_id", commit_id)
+    session.expire(branch, ["head_commit"])
+
+
+def get_state(branch: Branch, entity_id: int) -> Optional[BranchState]:
+    """Return current state of entity in branch or None if entity never existed in it"""
+    session = object_session(branch)
+    return session.query(BranchState).get((branch.id, entity_id))
+
+
+def set_state(branch: Branch, attribute: DbAttributes, *, deleted: bool = False, session: Session) -> BranchState:
+    """Point entity of `attribute` to it in branch state
+
+    Changes are flushed together with the commit which produced them
+    """
+    state = session.query(BranchState).get((branch.id, attribute.entity_id))
+    if state is None:
+        state = BranchState(branch_id=branch.id, entity_id=attribute.entity_id)
+        session.add(state)
+    state.attribute_id = attribute.id
+    state.deleted = deleted
+    return state
+
+
+def replay_state(commits: Iterable[Commit]) -> Dict[int, Tuple[DbAttributes, bool]]:
+    """Fold commits, newest first, into entity id -> (last attributes, deleted) mapping"""
+    state = {}
+    for commit in commits:
+        attr_in, attr_out = commit.attribute_in, commit.attribute_out
+        if attr_out is not None:
+            state.setdefault(attr_out.entity_id, (attr_out, False))
+        elif attr_in is not None:
+            state.setdefault(attr_in.entity_id, (attr_in, True))
+    return state
+
+
+def merge_state(branch: Branch, commits: Iterable[Commit], *, session: Session) -> None:
+    """Apply changes made by commits, newest first, to branch state with one statement"""
+    state = {entity_id: (attr.id, deleted) for entity_id, (attr, deleted) in replay_state(commits).items()}
+    upsert_state(branch, state, session=session)
+
+
+def upsert_state(branch: Branch, state: Dict[int, Tuple[int, bool]], *, session: Session) -> None:
+    """Set entity id -> (attribute id, deleted) pairs in branch state with one statement"""
+    rows = [
+        dict(branch_id=branch.id, entity_id=entity_id, attribute_id=attribute_id, deleted=deleted)
+        for entity_id, (attribute_id, deleted) in state.items()
+    ]
+    if not rows:
+        return
+    query = pg_insert(BranchState).values(rows)
+    query = query.on_conflict_do_update(
+        index_elements=[BranchState.branch_id, BranchState.entity_id],
+        set_=dict(attribute_id=query.excluded.attribute_id, deleted=query.excluded.deleted),
+    )
+    session.execute(query)
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, BranchState) and obj.branch_id == branch.id:
+            session.expire(obj)
+
+
+def copy_state(source: Branch, target: Branch, *, session: Session) -> None:
+    """Copy whole state of `source` branch into empty `target` branch"""
+    session.execute(
+        insert(BranchState).from_select(
+            ["branch_id", "entity_id", "attribute_id", "deleted"],
+            select(target.id, BranchState.entity_id, BranchState.attribute_id, BranchState.deleted).where(
+                BranchState.branch_id == source.id
+            ),
+        )
+    )
+
+
+def rebuild_state(branch: Branch, *, session: Session) -> None:
+    """Recalculate branch state from scratch by replaying its whole history
+
+    Used to fill state of branches created before states were maintained, see dbengine.backfill
+    """
+    logger.debug("rebuild_state")
+    session.query(BranchState).filter(BranchState.branch_id == branch.id).delete(synchronize_session=False)
+    merge_state(branch, branch.commits, session=session)
+
+
+def get_column_states(branch: Branch, table_id: int) -> List[BranchState]:
+    """Return states of alive columns of table in branch, attributes are loaded with them"""
+    session = object_session(branch)
+    return (
+        session.query(BranchState)
+        .options(joinedload(BranchState.attribute))
+        .join(DbColumn, DbColumn.id == BranchState.entity_id)
+        .filter(
+            and_(
+                BranchState.branch_id == branch.id,
+                BranchState.deleted.is_(False),
+                DbColumn.table_id == table_id,
+            )
+        )
+        .all()
+    )
@@ -1,13 +1,16 @@
 import logging
 from typing import List, Optional, Tuple
 
-import sqlalchemy.exc
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, object_session
 
 from dbengine.exceptions import ProhibitedActionInBranch, TableDeleted, TableDoesntExists
-from dbengine.models import AttributeTypes, Branch, BranchTypes, Commit, DbColumn, DbTable, DbTableAttributes
-from .column import create_column, delete_column
+from dbengine.models import AttributeTypes, Branch, BranchTypes, Commit, DbAttributes, DbEntity, DbTable
+from dbengine.models import DbTableAttributes
+from .checkpoint import in_branch, resolve_state
+from .bulk import Change, allocate_ids, transaction, write_changes
+from .column import delete_column
+from .graph import KINDS, commit_graph, replay_chain
+from .state import advance_head, get_column_states, get_state, set_state
 
 logger = logging.getLogger(__name__)
 
@@ -15,46 +18,56 @@ logger = logging.getLogger(__name__)
 def create_table(
     branch: Branch, name: str, columns_and_attr: Optional[List[Tuple[str, str]]] = None, *, session: Session
 ) -> Tuple[DbTable, DbTableAttributes, Commit]:
-    """Create table in branch with optional columns"""
+    """Create table in branch with optional columns
+
+    Table and columns are written in bulk, still with a separate commit for every column
+    """
     logging.debug("create_table")
     if branch.type != BranchTypes.WIP:
         raise ProhibitedActionInBranch("Table creating", branch.name)
-    s = session.query(Commit).filter(Commit.branch_id == branch.id).order_by(Commit.id.desc()).first()
-    new_commit = Commit(branch_id=branch.id, attribute_id_in=None)
-    if s:
-        new_commit.prev_commit_id = s.id
-    new_table = DbTable(type=AttributeTypes.TABLE)
-    session.add(new_table)
-    session.flush()
-    new_table_attribute = DbTableAttributes(type=AttributeTypes.TABLE, table_id=new_table.id, name=name)
-    session.add(new_table_attribute)
-    session.flush()
-    new_commit.attribute_id_out = new_table_attribute.id
-    session.add(new_commit)
-    session.flush()
-    if columns_and_attr:
-        for row in columns_and_attr:
-            create_column(branch, new_table, name=row[0], datatype=row[1], session=session)
-    return new_table, new_table_attribute, new_commit
+    columns_and_attr = columns_and_attr or []
+    table_id, *column_ids = allocate_ids(DbEntity, len(columns_and_attr) + 1, session=session)
+    changes = [Change(AttributeTypes.TABLE, table_id, table_id, attribute_out=dict(name=name), new_entity=True)]
+    for column_id, (column_name, datatype) in zip(column_ids, columns_and_attr):
+        changes.append(
+            Change(
+                AttributeTypes.COLUMN,
+                column_id,
+                table_id,
+                attribute_out=dict(name=column_name, datatype=datatype),
+                new_entity=True,
+            )
+        )
+    (commit_id, attribute_id), *_ = write_changes(branch, changes, session=session)
+    return (
+        session.query(DbTable).get(table_id),
+        session.query(DbTableAttributes).get(attribute_id),
+        session.query(Commit).get(commit_id),
+    )
 
 
 def get_table(branch: Branch, id: int, start_from_commit: Optional[Commit] = None) -> Tuple[DbTable, DbTableAttributes]:
-    """Return table and last attributes in branch by id"""
-    commit = branch.last_commit
-    attr_out: DbTableAttributes
-    if start_from_commit and start_from_commit in branch.commits:
-        commit = start_from_commit
-    for row in branch.commits_from(commit):
-        attr_out, attr_in = row.attribute_out, row.attribute_in
-        if attr_in is not None and attr_out is None:
-            if attr_in and attr_in.type == AttributeTypes.TABLE:
-                if attr_in.table_id == id:
-                    raise TableDeleted(id, branch.name)
-        elif (attr_in is not None and attr_out is not None) or (attr_in is None and attr_out is not None):
-            if attr_out and attr_out.type == AttributeTypes.TABLE:
-                if attr_out.table_id == id:
-                    return (attr_out.table, attr_out)
-    raise TableDoesntExists(id, branch.name)
+    """Return table and last attributes in branch by id
+
+    Current attributes are read from branch state, attributes at `start_from_commit` are resolved from checkpoint
+    """
+    if start_from_commit is None:
+        state = get_state(branch, id)
+        if state is None or state.attribute.type != AttributeTypes.TABLE:
+            raise TableDoesntExists(id, branch.name)
+        if state.deleted:
+            raise TableDeleted(id, branch.name)
+        return state.attribute.table, state.attribute
+    session = object_session(branch)
+    if not in_branch(branch, start_from_commit, session=session):
+        start_from_commit = branch.head_commit
+    found = resolve_state(start_from_commit, session=session).get(id)
+    attr = found and session.query(DbAttributes).get(found[0])
+    if not attr or attr.type != AttributeTypes.TABLE:
+        raise TableDoesntExists(id, branch.name)
+    if found[1]:
+        raise TableDeleted(id, branch.name)
+    return attr.table, attr
 
 
 def update_table(
@@ -69,33 +82,22 @@ def update_table(
     table_and_last_attributes = get_table(branch, table.id)
     if branch.type != BranchTypes.WIP:
         raise ProhibitedActionInBranch("Table altering", branch.name)
-    s = (
-        session.query(Commit).filter(
-            and_(Commit.branch_id == branch.id, Commit.attribute_id_out == table_and_last_attributes[1].id)
-        )
-    ).one_or_none()
-    s_main = (
-        session.query(Commit)
-        .filter(and_(Commit.branch_id == 1, Commit.attribute_id_out == table_and_last_attributes[1].id))
-        .one_or_none()
+    new_commit = Commit(
+        branch_id=branch.id, attribute_id_in=table_and_last_attributes[1].id, table_id=table_and_last_attributes[0].id
     )
-    new_commit = Commit()
-    new_commit.branch_id = branch.id
-    if s:
-        new_commit.prev_commit_id = s.id
-    elif (not s) and s_main:
-        new_commit.prev_commit_id = s_main.id
-    elif not (s and s_main):
-        raise TableDoesntExists(table.id, branch.name)
-    new_commit.attribute_id_in = table_and_last_attributes[1].id
+    new_commit.prev_commit_id = branch.head_commit_id
     new_table_attribute = DbTableAttributes(
         type=AttributeTypes.TABLE, table_id=table_and_last_attributes[0].id, name=name
     )
-    session.add(new_table_attribute)
-    session.flush()
-    new_commit.attribute_id_out = new_table_attribute.id
-    session.add(new_commit)
-    session.flush()
+    with transaction(session):
+        session.add(new_table_attribute)
+        session.flush()
+        new_commit.attribute_id_out = new_table_attribute.id
+        session.add(new_commit)
+        session.flush()
+        advance_head(branch, new_commit.id, new_commit.prev_commit_id, session=session)
+        set_state(branch, new_table_attribute, session=session)
+        session.flush()
     return table_and_last_attributes[0], new_table_attribute, new_commit
 
 
@@ -110,15 +112,21 @@ def delete_table(
     table_and_last_attributes = get_table(branch, table.id)
     if branch.type != BranchTypes.WIP:
         raise ProhibitedActionInBranch("Deleting table", branch.name)
-    columns = session.query(DbColumn).filter(DbColumn.table_id == table.id).all()
-    for row in columns:
-        delete_column(branch, row, session=session)
-    new_commit = Commit(attribute_id_in=table_and_last_attributes[1].id, attribute_id_out=None, branch_id=branch.id)
-    s = session.query(Commit).filter(Commit.branch_id == branch.id).order_by(Commit.id.desc()).first()
-    if s:
-        new_commit.prev_commit_id = s.id
-    session.add(new_commit)
-    session.flush()
+    with transaction(session):
+        for row in get_column_states(branch, table.id):
+            delete_column(branch, row.attribute.column, session=session)
+        new_commit = Commit(
+            attribute_id_in=table_and_last_attributes[1].id,
+            attribute_id_out=None,
+            branch_id=branch.id,
+            table_id=table_and_last_attributes[0].id,
+        )
+        new_commit.prev_commit_id = branch.head_commit_id
+        session.add(new_commit)
+        session.flush()
+        advance_head(branch, new_commit.id, new_commit.prev_commit_id, session=session)
+        set_state(branch, table_and_last_attributes[1], deleted=True, session=session)
+        session.flush()
     return new_commit
 
 
@@ -126,23 +134,17 @@ def get_tables(branch: Branch) -> List[int]:
     """
     Get list of table id's in branch
     """
-    try:
-        ids = []
-        deleted_ids = []
-        commit_in_branch = branch.last_commit
-        while True:
-            if not commit_in_branch.prev_commit:
-                return ids
-            attr_in, attr_out = commit_in_branch.attribute_in, commit_in_branch.attribute_out
-            if (attr_out is not None and attr_in is not None) or (attr_out is not None and attr_in is None):
-                if attr_out.type == AttributeTypes.TABLE:
-                    table_id = attr_out.table.id
-                    if table_id not in ids and table_id not in deleted_ids:
-                        ids.append(table_id)
-            commit_in_branch = commit_in_branch.prev_commit
-            if attr_out is None and attr_in is not None:
-                if attr_in.type == AttributeTypes.TABLE:
-                    deleted_ids.append(attr_in.table.id)
-            commit_in_branch = commit_in_branch.prev_commit
-    except sqlalchemy.exc.NoResultFound:
-        logging.error(sqlalchemy.exc.NoResultFound, exc_info=True)
+    chain = commit_graph.chain(object_session(branch), branch.head_commit_id)
+    if chain is not None:
+        tables = {entity for entity, kind in zip(chain.entity, chain.kind) if KINDS[kind] == AttributeTypes.TABLE}
+        return [entity for entity, (_, deleted) in replay_chain(chain).items() if entity in tables and not deleted]
+    ids = []
+    deleted_ids = set()
+    for commit in branch.commits:
+        attr_in, attr_out = commit.attribute_in, commit.attribute_out
+        if attr_out is not None and attr_out.type == AttributeTypes.TABLE:
+            if attr_out.table_id not in ids and attr_out.table_id not in deleted_ids:
+                ids.append(attr_out.table_id)
+        elif attr_out is None and attr_in is not None and attr_in.type == AttributeTypes.TABLE:
+            deleted_ids.add(attr_in.table_id)
+    return ids
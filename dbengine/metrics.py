@@ -0,0 +1,70 @@
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from weakref import WeakKeyDictionary
+
+from prometheus_client import Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METADATA_TARGET = "metadata"
+
+REQUEST_SECONDS = Histogram("dbengine_request_seconds", "Latency of HTTP requests", ["route", "method"])
+REQUEST_STATEMENTS = Histogram(
+    "dbengine_request_sql_statements",
+    "SQL statements executed by HTTP request",
+    ["route", "target"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000),
+)
+REQUEST_SQL_SECONDS = Histogram(
+    "dbengine_request_sql_seconds", "Time of SQL statements executed by HTTP request", ["route", "target"]
+)
+DDL_SECONDS = Histogram("dbengine_ddl_seconds", "Time of DDL statements of migrations", ["target"])
+
+_engine_targets: "WeakKeyDictionary[Engine, str]" = WeakKeyDictionary()
+
+
+class RequestStats:
+    """Number and time of SQL statements of one request by target database"""
+
+    def __init__(self):
+        self.statements: Dict[str, int] = {METADATA_TARGET: 0}
+        self.seconds: Dict[str, float] = {METADATA_TARGET: 0.0}
+
+    def add(self, target: str, seconds: float) -> None:
+        self.statements[target] = self.statements.get(target, 0) + 1
+        self.seconds[target] = self.seconds.get(target, 0.0) + seconds
+
+    def observe(self, route: str) -> None:
+        for target, count in self.statements.items():
+            REQUEST_STATEMENTS.labels(route, target).observe(count)
+            REQUEST_SQL_SECONDS.labels(route, target).observe(self.seconds[target])
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def register_engine(engine: Engine, target: str) -> None:
+    """Label statements of engine with target, engines not registered are metadata database"""
+    _engine_targets.setdefault(engine, target)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts: List[float] = conn.info.setdefault("metrics_query_start", [])
+    starts.append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["metrics_query_start"].pop()
+    stats = request_stats.get()
+    if stats is not None:
+        stats.add(_engine_targets.get(conn.engine, METADATA_TARGET), seconds)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    starts = context.connection.info.get("metrics_query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
@@ -1,11 +1,14 @@
-from .branch import Branch, BranchTypes, Commit
+from .branch import Branch, BranchState, BranchTypes, Commit, SchemaCheckpoint
 from .entity import AttributeTypes, DbAttributes, DbColumn, DbColumnAttributes, DbEntity, DbTable, DbTableAttributes
+from .merge_job import MergeJob, MergeJobActions, MergeJobStatuses
 
 
 __all__ = [
     "Branch",
+    "BranchState",
     "BranchTypes",
     "Commit",
+    "SchemaCheckpoint",
     "AttributeTypes",
     "DbAttributes",
     "DbColumn",
@@ -13,4 +16,7 @@ __all__ = [
     "DbEntity",
     "DbTable",
     "DbTableAttributes",
+    "MergeJob",
+    "MergeJobActions",
+    "MergeJobStatuses",
 ]
@@ -2,13 +2,13 @@ from __future__ import annotations
 
 from datetime import datetime
 from enum import Enum
-from typing import Iterator, List
+from typing import List, Optional
 
-from sqlalchemy import Column, DateTime
+from sqlalchemy import Boolean, Column, DateTime
 from sqlalchemy import Enum as EnumDb
-from sqlalchemy import ForeignKey, Integer, String
+from sqlalchemy import JSON, ForeignKey, Index, Integer, String, literal, select
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import aliased, object_session, relationship, selectinload
 
 from dbengine.models.entity import DbAttributes
 from .base import Base
@@ -32,30 +32,32 @@ class Branch(Base):
     type = Column(EnumDb(BranchTypes, native_enum=False), default=BranchTypes.WIP)
     name = Column(String)
     create_ts = Column(DateTime, default=datetime.utcnow, nullable=False)
+    head_commit_id = Column(Integer, ForeignKey("commit.id", use_alter=True, name="fk_branch_head_commit_id"))
 
     _commits: List[Commit] = relationship("Commit", foreign_keys="Commit.branch_id", order_by="desc(Commit.create_ts)")
+    head_commit: Commit = relationship("Commit", foreign_keys=[head_commit_id], post_update=True)
 
     @hybrid_property
     def last_commit(self) -> Commit:
-        return self._commits[0]
+        return self.head_commit
 
     @hybrid_property
     def first_commit(self) -> Commit:
         return self._commits[-1]
 
     @hybrid_property
-    def commits(self) -> Iterator[Commit]:
-        commit = self.last_commit
-        yield commit
-        while commit := commit.prev_commit:
-            yield commit
+    def commits(self) -> List[Commit]:
+        """All commits of branch history down to the first commit of main, newest first"""
+        return self.last_commit.ancestry()
+
+    @hybrid_property
+    def own_commits(self) -> List[Commit]:
+        """Commits made in branch after the branch point, newest first"""
+        return self.last_commit.ancestry(branch_id=self.id)
 
     @staticmethod
-    def commits_from(commit: Commit) -> Iterator[Commit]:
-        while commit.prev_commit is not None:
-            yield commit
-            commit = commit.prev_commit
-        yield commit
+    def commits_from(commit: Commit) -> List[Commit]:
+        return commit.ancestry()
 
     def __repr__(self):
         return f"<Branch id={self.id} type={self.type}>"
@@ -68,9 +70,11 @@ class Commit(Base):
     branch_id = Column(Integer, ForeignKey("branch.id"))
     attribute_id_in = Column(Integer, ForeignKey("db_attributes.id"))
     attribute_id_out = Column(Integer, ForeignKey("db_attributes.id"))
+    table_id = Column(Integer, ForeignKey("db_table.id"))
     create_ts = Column(DateTime, default=datetime.utcnow, nullable=False)
     sql_up = Column(String)
     sql_down = Column(String)
+    sql_dialect = Column(String)
 
     attribute_out: DbAttributes = relationship("DbAttributes", foreign_keys=[attribute_id_out])
     attribute_in: DbAttributes = relationship("DbAttributes", foreign_keys=[attribute_id_in])
@@ -80,5 +84,73 @@ class Commit(Base):
 
     branch: Branch = relationship("Branch", foreign_keys=[branch_id], back_populates="_commits")
 
+    # Tables touched by commits of branch, used to detect merge conflicts,
+    # and history of branch by time, used to find schema at timestamp
+    __table_args__ = (
+        Index("ix_commit_branch_id_table_id", "branch_id", "table_id"),
+        Index("ix_commit_branch_id_create_ts", "branch_id", "create_ts"),
+    )
+
+    def ancestry(self, *, branch_id: Optional[int] = None, until_id: Optional[int] = None) -> List[Commit]:
+        """Load commit and its ancestors with one recursive query, newest first
+
+        Attributes of loaded commits are fetched in bulk, so walking the chain doesn't hit database.
+        Walk stops when commit of other branch than `branch_id` is met or before commit with `until_id`.
+        """
+        chain = select(Commit.id, Commit.prev_commit_id, literal(0).label("depth")).where(Commit.id == self.id)
+        if branch_id is not None:
+            chain = chain.where(Commit.branch_id == branch_id)
+        if until_id is not None:
+            chain = chain.where(Commit.id != until_id)
+        chain = chain.cte("chain", recursive=True)
+        prev = aliased(Commit)
+        step = select(prev.id, prev.prev_commit_id, chain.c.depth + 1).join(chain, prev.id == chain.c.prev_commit_id)
+        if branch_id is not None:
+            step = step.where(prev.branch_id == branch_id)
+        if until_id is not None:
+            step = step.where(prev.id != until_id)
+        chain = chain.union_all(step)
+        return (
+            object_session(self)
+            .query(Commit)
+            .join(chain, Commit.id == chain.c.id)
+            .options(selectinload(Commit.attribute_in), selectinload(Commit.attribute_out))
+            .order_by(chain.c.depth)
+            .all()
+        )
+
     def __repr__(self):
         return f"<Commit id={self.id} branch_id={self.branch_id}>"
+
+
+class BranchState(Base):
+    """Materialized schema of a branch: last attributes of every entity touched in its history
+
+    Maintained on every commit, so current object lookups don't need to replay history.
+    Deleted entities keep their last attributes with `deleted` flag set.
+    """
+
+    branch_id = Column(Integer, ForeignKey("branch.id"), primary_key=True)
+    entity_id = Column(Integer, ForeignKey("db_entity.id"), primary_key=True)
+    attribute_id = Column(Integer, ForeignKey("db_attributes.id"), nullable=False)
+    deleted = Column(Boolean, default=False, nullable=False)
+
+    attribute: DbAttributes = relationship("DbAttributes", foreign_keys=[attribute_id])
+
+    def __repr__(self):
+        return f"<BranchState branch_id={self.branch_id} entity_id={self.entity_id} attribute_id={self.attribute_id}>"
+
+
+class SchemaCheckpoint(Base):
+    """Saved schema of main branch at commit
+
+    State is serialized as list of [entity id, attribute id, deleted] triples, so resolving schema
+    at any later commit replays history only back to the nearest checkpoint.
+    """
+
+    commit_id = Column(Integer, ForeignKey("commit.id"), primary_key=True)
+    state = Column(JSON, nullable=False)
+    create_ts = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<SchemaCheckpoint commit_id={self.commit_id}>"
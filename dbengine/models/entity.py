@@ -58,6 +58,10 @@ class DbTableAttributes(DbAttributes):
     __mapper_args__ = {"polymorphic_identity": AttributeTypes.TABLE, 'polymorphic_load': 'inline'}
     table: DbTable = relationship('DbTable', foreign_keys='DbTableAttributes.table_id')
 
+    @property
+    def entity_id(self) -> int:
+        return self.table_id
+
 
 class DbColumnAttributes(DbAttributes):
     id = Column(Integer, ForeignKey("db_attributes.id"), primary_key=True)
@@ -69,3 +73,7 @@ class DbColumnAttributes(DbAttributes):
     __mapper_args__ = {"polymorphic_identity": AttributeTypes.COLUMN, 'polymorphic_load': 'inline'}
     column: DbColumn = relationship('DbColumn', foreign_keys='DbColumnAttributes.column_id')
     table: DbTable = relationship('DbTable', foreign_keys='DbColumnAttributes.table_id')
+
+    @property
+    def entity_id(self) -> int:
+        return self.column_id
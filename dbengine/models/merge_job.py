@@ -0,0 +1,38 @@
+from datetime import datetime
+from enum import Enum
+
+from sqlalchemy import Column, DateTime
+from sqlalchemy import Enum as EnumDb
+from sqlalchemy import ForeignKey, Integer, String
+from sqlalchemy.orm import relationship
+
+from .base import Base
+from .branch import Branch
+
+
+class MergeJobActions(str, Enum):
+    REQUEST = "REQUEST MERGE"
+    APPROVE = "APPROVE MERGE"
+
+
+class MergeJobStatuses(str, Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+
+class MergeJob(Base):
+    id = Column(Integer, primary_key=True)
+    branch_id = Column(Integer, ForeignKey("branch.id"), nullable=False, index=True)
+    action = Column(EnumDb(MergeJobActions, native_enum=False), nullable=False)
+    status = Column(EnumDb(MergeJobStatuses, native_enum=False), default=MergeJobStatuses.QUEUED, nullable=False)
+    create_ts = Column(DateTime, default=datetime.utcnow, nullable=False)
+    start_ts = Column(DateTime)
+    finish_ts = Column(DateTime)
+    error = Column(String)
+
+    branch: Branch = relationship("Branch", foreign_keys=[branch_id])
+
+    def __repr__(self):
+        return f"<MergeJob id={self.id} branch_id={self.branch_id} status={self.status}>"
@@ -1,11 +1,19 @@
-from fastapi import FastAPI
+from anyio.to_thread import current_default_thread_limiter
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_sqlalchemy import DBSessionMiddleware
+from fastapi_sqlalchemy import DBSessionMiddleware, db
 
+from dbengine.backfill import backfill
+from dbengine.db_connector import dispose_engines
+from dbengine.exceptions import BranchHeadMoved
+from dbengine.methods import checkpoint, fail_unfinished_merge_jobs
+from dbengine.methods.graph import commit_graph
 from dbengine.settings import Settings
 
-from .branch import branch_router
+from .branch import branch_router, job_runner, prod_connector, test_connector
 from .column import column_router
+from .metrics import MetricsMiddleware, metrics_router
 from .table import table_router
 
 
@@ -15,9 +23,13 @@ app = FastAPI()
 app.add_middleware(
     DBSessionMiddleware,
     db_url=settings.DB_DSN,
+    engine_args={"pool_size": settings.THREAD_POOL_SIZE},
     session_args={"autocommit": True},
 )
 
+# Added after session middleware to wrap it, so statements of the whole request are counted
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -29,3 +41,28 @@ app.add_middleware(
 app.include_router(branch_router)
 app.include_router(table_router)
 app.include_router(column_router)
+app.include_router(metrics_router)
+
+
+@app.exception_handler(BranchHeadMoved)
+def branch_head_moved(request: Request, exc: BranchHeadMoved):
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+
+@app.on_event("startup")
+def startup():
+    # Handlers are synchronous and run in the thread pool, its size bounds concurrent database work
+    current_default_thread_limiter().total_tokens = settings.THREAD_POOL_SIZE
+    commit_graph.max_size = settings.COMMIT_GRAPH_SIZE
+    checkpoint.CHECKPOINT_INTERVAL = settings.CHECKPOINT_INTERVAL
+    for connector in (test_connector, prod_connector):
+        connector.check_parallelism()
+    with db():
+        backfill(session=db.session)
+        fail_unfinished_merge_jobs(session=db.session)
+
+
+@app.on_event("shutdown")
+def shutdown():
+    job_runner.shutdown()
+    dispose_engines()
@@ -1,50 +1,188 @@
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.exceptions import HTTPException
 from fastapi_sqlalchemy import db
 
 from dbengine.db_connector import CONNECTOR_DICT
-from dbengine.exceptions import BranchError, BranchNotFoundError
-from dbengine.methods import create_branch, get_branch, ok_branch, request_merge_branch, unrequest_merge_branch
-from dbengine.models import BranchTypes
+from dbengine.exceptions import (
+    BatchOperationError,
+    BranchError,
+    BranchNotFoundError,
+    ColumnDeleted,
+    ColumnDoesntExists,
+    CommitNotFoundError,
+    MergeJobAlreadyQueued,
+    MergeJobNotFoundError,
+    ProhibitedActionInBranch,
+    TableDeleted,
+    TableDoesntExists,
+)
+from dbengine.job_runner import JobRunner
+from dbengine.methods import (
+    apply_batch,
+    create_branch,
+    create_merge_job,
+    get_branch,
+    get_commit,
+    get_commit_at,
+    get_merge_job,
+    get_merge_jobs,
+    get_schema,
+    run_merge_job,
+    unrequest_merge_branch,
+)
+from dbengine.methods.batch import Operation
+from dbengine.methods.diff import get_diff
+from dbengine.methods.converters import diff_aggregator, schema_aggregator
+from dbengine.models import BranchTypes, MergeJobActions
 import dbengine.models
-from dbengine.routes.models import Branch
+from dbengine.routes.cache import cached_response
+from dbengine.routes.profiler import ProfiledRoute
+from dbengine.routes.models import BatchOperation, BatchResult, Branch, MergeJob, SchemaDiff, TableSchema
 from dbengine.settings import Settings
 
 settings = Settings()
 
-test_connector = CONNECTOR_DICT[settings.DWH_CONNECTION_TEST.scheme](settings.DWH_CONNECTION_TEST)
-prod_connector = CONNECTOR_DICT[settings.DWH_CONNECTION_PROD.scheme](settings.DWH_CONNECTION_PROD)
+connector_args = dict(
+    pool_size=settings.DWH_POOL_SIZE,
+    max_overflow=settings.DWH_POOL_MAX_OVERFLOW,
+    pool_recycle=settings.DWH_POOL_RECYCLE,
+    pool_pre_ping=settings.DWH_POOL_PRE_PING,
+    transactional=settings.DWH_TRANSACTIONAL_MIGRATION,
+    compact=settings.DWH_COMPACT_MIGRATION,
+)
+test_connector = CONNECTOR_DICT[settings.DWH_CONNECTION_TEST.scheme](
+    settings.DWH_CONNECTION_TEST, target="test", parallelism=settings.MIGRATION_PARALLELISM, **connector_args
+)
+prod_connector = CONNECTOR_DICT[settings.DWH_CONNECTION_PROD.scheme](
+    settings.DWH_CONNECTION_PROD,
+    target="prod",
+    parallelism=settings.MIGRATION_PARALLELISM if settings.MIGRATION_PARALLEL_PROD else 1,
+    **connector_args,
+)
 
-branch_router = APIRouter(prefix="/branch", tags=["Branch"])
+job_runner = JobRunner(settings.MERGE_JOB_WORKERS, settings.MERGE_JOB_TARGET_CONCURRENCY)
 
+branch_router = APIRouter(prefix="/branch", tags=["Branch"], route_class=ProfiledRoute)
 
-@branch_router.get("/{branch_id}", response_model=Branch)
-async def http_get_branch(branch_id: int):
+
+def _run_merge_job(job_id: int):
+    with db():
+        run_merge_job(job_id, session=db.session, test_connector=test_connector, prod_connector=prod_connector)
+
+
+def _submit_merge_job(branch_id: int, action: MergeJobActions) -> dbengine.models.MergeJob:
     try:
-        return get_branch(branch_id, session=db.session)
+        branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
         raise HTTPException(status_code=404, detail="Branch not found")
+    try:
+        job = create_merge_job(branch, action, session=db.session)
+    except MergeJobAlreadyQueued as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    targets = [test_connector] if action == MergeJobActions.REQUEST else [test_connector, prod_connector]
+    job_runner.submit(_run_merge_job, job.id, targets=targets)
+    return job
 
 
-@branch_router.post("/{branch_name}", response_model=Branch)
-async def http_create_branch_by_name(branch_name: str) -> Branch:
-    return create_branch(branch_name, session=db.session)
+@branch_router.get("/{branch_id}", response_model=Branch)
+def http_get_branch(request: Request, branch_id: int):
+    try:
+        branch = get_branch(branch_id, session=db.session)
+    except BranchNotFoundError:
+        raise HTTPException(status_code=404, detail="Branch not found")
+    # Type and name change without new commits
+    return cached_response(request, branch, Branch, lambda: branch, branch.type, branch.name)
 
 
-@branch_router.post("/{branch_id}/merge/request", response_model=Branch)
-async def http_request_merge_branch(branch_id: int) -> Branch:
-    test_connector.connect()
+@branch_router.get("/{branch_id}/schema", response_model=List[TableSchema])
+def http_get_branch_schema(
+    request: Request, branch_id: int, commit_id: Optional[int] = None, at: Optional[datetime] = None
+):
+    if commit_id is not None and at is not None:
+        raise HTTPException(status_code=400, detail="Only one of commit_id and at can be given")
+    try:
+        branch = get_branch(branch_id, session=db.session)
+    except BranchNotFoundError:
+        raise HTTPException(status_code=404, detail="Branch not found")
+    try:
+        commit = None
+        if commit_id is not None:
+            commit = get_commit(branch, commit_id)
+        elif at is not None:
+            commit = get_commit_at(branch, at)
+    except CommitNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return cached_response(request, branch, List[TableSchema], lambda: schema_aggregator(get_schema(branch, commit)))
+
+
+@branch_router.get("/{branch_id}/diff", response_model=SchemaDiff)
+def http_get_branch_diff(
+    request: Request,
+    branch_id: int,
+    base_branch_id: int = 1,
+    commit_id: Optional[int] = None,
+    base_commit_id: Optional[int] = None,
+):
     try:
         branch = get_branch(branch_id, session=db.session)
+        base_branch = get_branch(base_branch_id, session=db.session)
     except BranchNotFoundError:
         raise HTTPException(status_code=404, detail="Branch not found")
-    return request_merge_branch(branch, session=db.session, test_connector=test_connector)
+    try:
+        head = get_commit(branch, commit_id) if commit_id is not None else branch.head_commit
+        base = get_commit(base_branch, base_commit_id) if base_commit_id is not None else base_branch.head_commit
+    except CommitNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    def render():
+        diff = get_diff(base, head, session=db.session)
+        commits = list(reversed(diff.commits))
+        sql_up = [up for up, _ in prod_connector.generate_sql(commits, branch, head) if up is not None]
+        return dict(
+            base_commit_id=base.id,
+            head_commit_id=head.id,
+            ancestor_commit_id=diff.ancestor_id,
+            sql_up=sql_up,
+            **diff_aggregator(diff),
+        )
+
+    return cached_response(request, branch, SchemaDiff, render, base_branch.head_commit_id)
+
+
+@branch_router.post("/{branch_id}/batch", response_model=List[BatchResult])
+def http_apply_batch(branch_id: int, operations: List[BatchOperation]):
+    try:
+        branch = get_branch(branch_id, session=db.session)
+    except BranchNotFoundError:
+        raise HTTPException(status_code=404, detail="Branch not found")
+    try:
+        result = apply_batch(branch, [Operation(**op.dict()) for op in operations], session=db.session)
+    except ProhibitedActionInBranch:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    except (TableDoesntExists, ColumnDoesntExists) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except (TableDeleted, ColumnDeleted) as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except BatchOperationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [BatchResult(id=id, commit_id=commit_id) for id, commit_id in result]
+
+
+@branch_router.post("/{branch_name}", response_model=Branch)
+def http_create_branch_by_name(branch_name: str) -> Branch:
+    return create_branch(branch_name, session=db.session)
+
+
+@branch_router.post("/{branch_id}/merge/request", response_model=MergeJob, status_code=202)
+def http_request_merge_branch(branch_id: int):
+    return _submit_merge_job(branch_id, MergeJobActions.REQUEST)
 
 
 @branch_router.post("/{branch_id}/merge/unrequest", response_model=Branch)
-async def http_unreguest_merge_branch(branch_id: int) -> Branch:
+def http_unreguest_merge_branch(branch_id: int) -> Branch:
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
@@ -52,24 +190,38 @@ async def http_unreguest_merge_branch(branch_id: int) -> Branch:
     return unrequest_merge_branch(branch, session=db.session)
 
 
-@branch_router.post("/{branch_id}/merge/approve", response_model=Branch)
-async def http_merge_branch(branch_id: int) -> Branch:
-    prod_connector.connect()
-    test_connector.connect()
+@branch_router.post("/{branch_id}/merge/approve", response_model=MergeJob, status_code=202)
+def http_merge_branch(branch_id: int):
+    return _submit_merge_job(branch_id, MergeJobActions.APPROVE)
+
+
+@branch_router.get("/{branch_id}/merge/job", response_model=List[MergeJob])
+def http_get_merge_jobs(branch_id: int):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
         raise HTTPException(status_code=404, detail="Branch not found")
-    return ok_branch(branch, session=db.session, prod_connector=prod_connector, test_connector=test_connector)
+    return get_merge_jobs(branch, session=db.session)
+
+
+@branch_router.get("/{branch_id}/merge/job/{job_id}", response_model=MergeJob)
+def http_get_merge_job(branch_id: int, job_id: int):
+    try:
+        job = get_merge_job(job_id, session=db.session)
+    except MergeJobNotFoundError:
+        raise HTTPException(status_code=404, detail="Merge job not found")
+    if job.branch_id != branch_id:
+        raise HTTPException(status_code=404, detail="Merge job not found")
+    return job
 
 
 @branch_router.get("", response_model=List[Branch])
-async def http_get_all_branches():
+def http_get_all_branches():
     return db.session.query(dbengine.models.Branch).all()
 
 
 @branch_router.post("", response_model=Branch)
-async def http_create_branch():
+def http_create_branch():
     try:
         return create_branch(name="default name", session=db.session)
     except BranchError as e:
@@ -77,7 +229,7 @@ async def http_create_branch():
 
 
 @branch_router.patch("/{branch_id}", response_model=Branch)
-async def patch_branch(branch_id: int, name: str):
+def patch_branch(branch_id: int, name: str):
     branch = db.session.query(dbengine.models.Branch).get(branch_id)
     if not branch:
         raise HTTPException(status_code=404)
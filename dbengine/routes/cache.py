@@ -0,0 +1,83 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+
+from dbengine.models import Branch
+from dbengine.settings import Settings
+
+settings = Settings()
+
+
+class ResponseCache:
+    """Thread safe LRU of rendered response bodies"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            body = self._data.get(key)
+            if body is not None:
+                self._data.move_to_end(key)
+            return body
+
+    def put(self, key: Hashable, body: bytes) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = body
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_SIZE)
+
+
+def make_etag(*parts: Hashable) -> str:
+    return '"%s"' % hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def cached_response(
+    request: Request, branch: Branch, model: Any, render: Callable[[], Any], *extra: Hashable
+) -> Response:
+    """Return response of read endpoint, reusing it while branch head commit stays the same
+
+    Result of the endpoint depends only on its url and history of the branch, so the head commit
+    identifies it. `extra` are other branch fields the result depends on.
+    Answers `If-None-Match` with 304 without calling `render`.
+    """
+    query = tuple(sorted(request.query_params.multi_items()))
+    key = (request.url.path, query, branch.id, branch.head_commit_id, *extra)
+    etag = make_etag(*key)
+    headers = {"ETag": etag}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    body = response_cache.get(key)
+    if body is None:
+        body = JSONResponse(jsonable_encoder(parse_obj_as(model, render()))).body
+        response_cache.put(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,20 +1,29 @@
 from typing import List
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.exceptions import HTTPException
 from fastapi_sqlalchemy import db
 
 from dbengine.exceptions import BranchNotFoundError, TableDoesntExists, TableDeleted, ProhibitedActionInBranch
-from dbengine.methods import create_column, delete_column, get_branch, get_column, get_table, update_column
-from dbengine.methods.converters import column_aggregator
-from dbengine.methods.column import get_columns
+from dbengine.methods import (
+    create_column,
+    delete_column,
+    get_branch,
+    get_column,
+    get_table,
+    update_column,
+)
+from dbengine.methods.converters import column_aggregator, schema_aggregator
+from dbengine.methods.state import get_column_states
+from dbengine.routes.cache import cached_response
+from dbengine.routes.profiler import ProfiledRoute
 from dbengine.routes.models import Column
 
-column_router = APIRouter(prefix="/table/{table_id}/column", tags=["Column"])
+column_router = APIRouter(prefix="/table/{table_id}/column", tags=["Column"], route_class=ProfiledRoute)
 
 
 @column_router.post("", response_model=Column)
-async def http_create_column(branch_id: int, table_id: int, name: str, datatype: str):
+def http_create_column(branch_id: int, table_id: int, name: str, datatype: str):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
@@ -33,17 +42,21 @@ async def http_create_column(branch_id: int, table_id: int, name: str, datatype:
 
 
 @column_router.get("/{column_id}", response_model=Column)
-async def http_get_column(branch_id: int, column_id: int):
+def http_get_column(request: Request, branch_id: int, column_id: int):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
         raise HTTPException(status_code=404, detail="Branch not found")
-    result = get_column(branch, column_id)
-    return column_aggregator(result[0], result[1])
+
+    def render():
+        result = get_column(branch, column_id)
+        return column_aggregator(result[0], result[1])
+
+    return cached_response(request, branch, Column, render)
 
 
 @column_router.patch("/{column_id}", response_model=Column)
-async def http_update_column(branch_id: int, column_id: int, name: str, datatype: str):
+def http_update_column(branch_id: int, column_id: int, name: str, datatype: str):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
@@ -57,7 +70,7 @@ async def http_update_column(branch_id: int, column_id: int, name: str, datatype
 
 
 @column_router.delete("/{column_id}")
-async def http_delete_column(branch_id: int, column_id: int):
+def http_delete_column(branch_id: int, column_id: int):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
@@ -70,20 +83,20 @@ async def http_delete_column(branch_id: int, column_id: int):
 
 
 @column_router.get("", response_model=List[Column])
-async def http_get_columns_in_branch(branch_id: int, table_id: int):
+def http_get_columns_in_branch(request: Request, branch_id: int, table_id: int):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
         raise HTTPException(status_code=404, detail="Branch not found")
-    try:
-        table = get_table(branch, table_id)[0]
-    except TableDoesntExists as e:
-        raise HTTPException(status_code=404, detail=e)
-    except TableDeleted as e:
-        raise HTTPException(status_code=410, detail=e)
-    column_ids = get_columns(branch, table, session=db.session)
-    result = []
-    for row in column_ids:
-        column = get_column(branch, row)
-        result.append(column_aggregator(column[0], column[1]))
-    return result
+
+    def render():
+        try:
+            table_attr = get_table(branch, table_id)[1]
+        except TableDoesntExists as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except TableDeleted as e:
+            raise HTTPException(status_code=410, detail=str(e))
+        columns = [state.attribute for state in get_column_states(branch, table_id)]
+        return schema_aggregator([table_attr, *columns])[0]["columns"]
+
+    return cached_response(request, branch, List[Column], render)
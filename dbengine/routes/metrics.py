@@ -0,0 +1,40 @@
+import time
+
+from fastapi import APIRouter, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.routing import Match
+
+from dbengine.metrics import REQUEST_SECONDS, RequestStats, request_stats
+
+metrics_router = APIRouter(tags=["Metrics"])
+
+
+def get_route_template(request: Request) -> str:
+    """Return path template of route serving request, so labels don't grow with ids in paths"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Collect latency and SQL statements of every request"""
+
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            return await call_next(request)
+        finally:
+            route = get_route_template(request)
+            REQUEST_SECONDS.labels(route, request.method).observe(time.perf_counter() - start)
+            stats.observe(route)
+            request_stats.reset(token)
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+def http_get_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
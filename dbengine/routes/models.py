@@ -1,8 +1,10 @@
 from datetime import datetime
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
-from dbengine.models import BranchTypes
+from dbengine.models import AttributeTypes, BranchTypes, MergeJobActions, MergeJobStatuses
+from dbengine.models.branch import CommitActionTypes
 
 
 class MyModel(BaseModel):
@@ -27,3 +29,73 @@ class Column(MyModel):
     table_id: int = Field(...)
     name: str
     datatype: str
+
+
+class TableSchema(Table):
+    columns: List[Column]
+
+
+class ColumnCreate(BaseModel):
+    name: str
+    datatype: str
+
+
+class TableCreate(BaseModel):
+    name: str
+    columns: List[ColumnCreate] = []
+
+
+class BatchOperation(BaseModel):
+    action: CommitActionTypes
+    type: AttributeTypes
+    id: Optional[int] = Field(None, title="Id of changed object, negative for objects created in batch")
+    table_id: Optional[int] = Field(None, title="Table of created column")
+    name: Optional[str]
+    datatype: Optional[str]
+
+
+class BatchResult(BaseModel):
+    id: int = Field(..., title="Id of changed object")
+    commit_id: int = Field(...)
+
+
+class TableChange(BaseModel):
+    before: Table
+    after: Table
+
+
+class ColumnChange(BaseModel):
+    before: Column
+    after: Column
+
+
+class TableChanges(BaseModel):
+    added: List[Table]
+    removed: List[Table]
+    altered: List[TableChange]
+
+
+class ColumnChanges(BaseModel):
+    added: List[Column]
+    removed: List[Column]
+    altered: List[ColumnChange]
+
+
+class SchemaDiff(BaseModel):
+    base_commit_id: int
+    head_commit_id: int
+    ancestor_commit_id: Optional[int]
+    tables: TableChanges
+    columns: ColumnChanges
+    sql_up: List[str] = Field(..., title="Migration from common ancestor to head")
+
+
+class MergeJob(MyModel):
+    id: int = Field(..., title="Merge job id")
+    branch_id: int = Field(...)
+    action: MergeJobActions
+    status: MergeJobStatuses
+    create_ts: datetime
+    start_ts: Optional[datetime]
+    finish_ts: Optional[datetime]
+    error: Optional[str]
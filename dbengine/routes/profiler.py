@@ -0,0 +1,115 @@
+import asyncio
+import cProfile
+import functools
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+from dbengine.metrics import request_stats
+from dbengine.settings import Settings
+
+logger = logging.getLogger(__name__)
+settings = Settings()
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY = "profile"
+
+_profile: ContextVar[Optional[cProfile.Profile]] = ContextVar("profile", default=None)
+
+
+def profile_requested(request: Request) -> bool:
+    """Check if client asked to profile request and profiling is enabled in settings"""
+    if not settings.PROFILING_ENABLED:
+        return False
+    flag = request.headers.get(PROFILE_HEADER) or request.query_params.get(PROFILE_QUERY)
+    return flag is not None and flag.lower() in ("1", "true", "yes")
+
+
+def _profiled(call: Callable) -> Callable:
+    """Run endpoint under profiler of current request, if there is one
+
+    Synchronous endpoints run in worker thread, so profiler is enabled there and not in event loop.
+    """
+
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        profile = _profile.get()
+        if profile is None:
+            return call(*args, **kwargs)
+        try:
+            profile.enable()
+        except ValueError:
+            # Other profiler is active in this thread
+            return call(*args, **kwargs)
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profile.disable()
+
+    return wrapper
+
+
+def save_profile(profile: cProfile.Profile, request: Request, route: str, response: Optional[Response], seconds: float):
+    """Write profile and JSON with request details next to it to PROFILE_DIR"""
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    created_at = datetime.utcnow()
+    slug = re.sub(r"[^a-zA-Z0-9]+", "_", route).strip("_") or "root"
+    path = os.path.join(settings.PROFILE_DIR, f"{created_at:%Y%m%dT%H%M%S}_{slug}_{uuid.uuid4().hex[:8]}")
+    stats = request_stats.get()
+    branch_id = request.path_params.get("branch_id") or request.query_params.get("branch_id")
+    profile.dump_stats(f"{path}.prof")
+    with open(f"{path}.json", "w") as file:
+        json.dump(
+            dict(
+                created_at=created_at.isoformat(),
+                route=route,
+                method=request.method,
+                path=request.url.path,
+                branch_id=int(branch_id) if branch_id is not None and str(branch_id).isdigit() else branch_id,
+                status_code=response.status_code if response is not None else None,
+                seconds=seconds,
+                statements=dict(stats.statements) if stats is not None else None,
+                sql_seconds=dict(stats.seconds) if stats is not None else None,
+            ),
+            file,
+            indent=2,
+        )
+    logger.info("Profile of %s %s written to %s.prof", request.method, route, path)
+
+
+class ProfiledRoute(APIRoute):
+    """Route which runs endpoint under cProfile when client asks for it with X-Profile header
+    or `profile` query parameter, see PROFILING_ENABLED and PROFILE_DIR settings
+    """
+
+    def get_route_handler(self) -> Callable:
+        if not asyncio.iscoroutinefunction(self.dependant.call):
+            self.dependant.call = _profiled(self.dependant.call)
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request: Request) -> Response:
+            if not profile_requested(request):
+                return await handler(request)
+            profile, response = cProfile.Profile(), None
+            token = _profile.set(profile)
+            start = time.perf_counter()
+            try:
+                response = await handler(request)
+                return response
+            finally:
+                _profile.reset(token)
+                try:
+                    save_profile(profile, request, self.path, response, time.perf_counter() - start)
+                except OSError as e:
+                    logger.error(f"Failed to write profile: {e}")
+
+        return profiled_handler
@@ -1,18 +1,21 @@
 from typing import List
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi_sqlalchemy import db
 
 from dbengine.exceptions import TableDoesntExists, TableDeleted, BranchNotFoundError, ProhibitedActionInBranch
-from dbengine.methods import create_table, delete_table, get_branch, get_table, get_tables, update_table
-from dbengine.methods.converters import table_aggregator
-from dbengine.routes.models import Table
+from dbengine.methods import create_table, delete_table, get_branch, get_schema, get_table, update_table
+from dbengine.methods.state import get_column_states
+from dbengine.methods.converters import schema_aggregator, table_aggregator
+from dbengine.routes.cache import cached_response
+from dbengine.routes.profiler import ProfiledRoute
+from dbengine.routes.models import Table, TableCreate, TableSchema
 
-table_router = APIRouter(prefix="/table", tags=["Table"])
+table_router = APIRouter(prefix="/table", tags=["Table"], route_class=ProfiledRoute)
 
 
 @table_router.post("", response_model=Table)
-async def http_create_table(branch_id: int, table_name: str):
+def http_create_table(branch_id: int, table_name: str):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
@@ -24,23 +27,42 @@ async def http_create_table(branch_id: int, table_name: str):
     return table_aggregator(result[0], result[1])
 
 
-@table_router.get("/{table_id}", response_model=Table)
-async def http_get_table(branch_id: int, table_id: int):
+@table_router.post("/bulk", response_model=TableSchema)
+def http_create_table_with_columns(branch_id: int, table: TableCreate):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
         raise HTTPException(status_code=404, detail="Branch not found")
+    columns_and_attr = [(column.name, column.datatype) for column in table.columns]
     try:
-        table = get_table(branch, table_id)
-        return table_aggregator(table[0], table[1])
-    except TableDoesntExists as e:
-        raise HTTPException(status_code=404, detail=e)
-    except TableDeleted as e:
-        raise HTTPException(status_code=410, detail=e)
+        result = create_table(branch, table.name, columns_and_attr, session=db.session)
+    except ProhibitedActionInBranch:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    columns = [state.attribute for state in get_column_states(branch, result[0].id)]
+    return schema_aggregator([result[1], *columns])[0]
+
+
+@table_router.get("/{table_id}", response_model=Table)
+def http_get_table(request: Request, branch_id: int, table_id: int):
+    try:
+        branch = get_branch(branch_id, session=db.session)
+    except BranchNotFoundError:
+        raise HTTPException(status_code=404, detail="Branch not found")
+
+    def render():
+        try:
+            table = get_table(branch, table_id)
+            return table_aggregator(table[0], table[1])
+        except TableDoesntExists as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except TableDeleted as e:
+            raise HTTPException(status_code=410, detail=str(e))
+
+    return cached_response(request, branch, Table, render)
 
 
 @table_router.patch("/{table_id}", response_model=Table)
-async def http_update_table(branch_id: int, table_id: int, name: str):
+def http_update_table(branch_id: int, table_id: int, name: str):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
@@ -59,7 +81,7 @@ async def http_update_table(branch_id: int, table_id: int, name: str):
 
 
 @table_router.delete("/{table_id}")
-async def http_delete_table(branch_id: int, table_id: int):
+def http_delete_table(branch_id: int, table_id: int):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
@@ -77,14 +99,13 @@ async def http_delete_table(branch_id: int, table_id: int):
 
 
 @table_router.get("", response_model=List[Table])
-async def http_get_tables_in_branch(branch_id: int):
+def http_get_tables_in_branch(request: Request, branch_id: int):
     try:
         branch = get_branch(branch_id, session=db.session)
     except BranchNotFoundError:
         raise HTTPException(status_code=404, detail="Branch not found")
-    table_ids = get_tables(branch)
-    result = []
-    for row in table_ids:
-        table = get_table(branch, row)
-        result.append(table_aggregator(table[0], table[1]))
-    return result
+
+    def render():
+        return [{"id": row["id"], "name": row["name"]} for row in schema_aggregator(get_schema(branch))]
+
+    return cached_response(request, branch, List[Table], render)
@@ -3,8 +3,24 @@ from pydantic import BaseSettings, AnyUrl, PostgresDsn
 
 class Settings(BaseSettings):
     DB_DSN: PostgresDsn
+    THREAD_POOL_SIZE: int = 40
     DWH_CONNECTION_TEST: AnyUrl
     DWH_CONNECTION_PROD: AnyUrl
+    DWH_POOL_SIZE: int = 5
+    DWH_POOL_MAX_OVERFLOW: int = 10
+    DWH_POOL_RECYCLE: int = 1800
+    DWH_POOL_PRE_PING: bool = True
+    DWH_TRANSACTIONAL_MIGRATION: bool = True
+    DWH_COMPACT_MIGRATION: bool = True
+    MIGRATION_PARALLELISM: int = 1
+    MIGRATION_PARALLEL_PROD: bool = False
+    MERGE_JOB_WORKERS: int = 4
+    MERGE_JOB_TARGET_CONCURRENCY: int = 1
+    RESPONSE_CACHE_SIZE: int = 256
+    COMMIT_GRAPH_SIZE: int = 1_000_000
+    CHECKPOINT_INTERVAL: int = 100
+    PROFILING_ENABLED: bool = False
+    PROFILE_DIR: str = "profiles"
 
     class Config:
         case_sensitive = True
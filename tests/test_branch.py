@@ -1,13 +1,27 @@
 from typing import List
 import pytest
+from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql.base import PGDialect
+from sqlalchemy.engine import TwoPhaseTransaction
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.attributes import set_committed_value
 
 from dbengine.methods import *
-from dbengine.exceptions import BranchError
-from dbengine.models import BranchTypes
+from dbengine.db_connector import PostgreConnector
+from dbengine.db_connector.planner import Statement, Step, StepActions, group_steps, independent_groups
+from dbengine.backfill import backfill
+from dbengine.exceptions import BranchError, BranchHeadMoved, ColumnDeleted, FatalMigrationError, MergeError
+from dbengine.exceptions import MigrationError
+from dbengine.methods import checkpoint
+from dbengine.methods.branch import check_conflicts
+from dbengine.methods.diff import get_diff
+from dbengine.methods.graph import commit_graph
+from dbengine.methods.state import replay_state
+from dbengine.models import Branch, BranchState, BranchTypes, DbColumnAttributes, SchemaCheckpoint
 from dbengine.models.branch import Commit
 from . import test_connector, prod_connector
 
-from . import Session
+from . import Session, settings
 
 
 def test_main():
@@ -64,6 +78,7 @@ def test_commit_iteration():
     assert commit2.prev_commit == commit1
     assert commit2 in commit1.next_commit
     assert commit1.branch == commit2.branch == branch
+    assert branch.head_commit == commit2
 
     # First commit in branch is empty commit
     assert commit1.prev_commit.prev_commit.branch.type == BranchTypes.MAIN
@@ -74,3 +89,473 @@ def test_commit_iteration():
     assert log[0] == commit2
     assert log[1] == commit1
     assert log[3].branch.type == BranchTypes.MAIN
+
+
+def test_commit_ancestry():
+    session = Session()
+    branch = create_branch("Test 4", session=session)
+    _, _, commit1 = create_table(branch, "Test_4_Table_1", session=session)
+    _, _, commit2 = create_table(branch, "Test_4_Table_2", session=session)
+
+    own: List[Commit] = branch.own_commits
+    assert own[:2] == [commit2, commit1]
+    assert len(own) == 3
+    assert own[-1].prev_commit.branch.type == BranchTypes.MAIN
+
+    assert commit2.ancestry(until_id=commit1.id) == [commit2]
+    assert branch.commits[: len(own)] == own
+
+
+def test_generate_migration():
+    session = Session()
+    branch = create_branch("Test 5", session=session)
+    table, _, _ = create_table(branch, "test_5_table", session=session)
+    _, _, commit1 = create_column(branch, table, name="id", datatype="INTEGER", session=session)
+    update_table(branch, table, name="test_5_table_renamed", session=session)
+    _, _, commit2 = create_column(branch, table, name="name", datatype="TEXT", session=session)
+    test_connector.generate_migration(branch)
+    session.flush()
+
+    assert commit1.sql_up == "ALTER TABLE test_5_table ADD COLUMN id INTEGER;"
+    assert commit2.sql_up == "ALTER TABLE test_5_table_renamed ADD COLUMN name TEXT;"
+    assert commit2.sql_down == "ALTER TABLE test_5_table_renamed DROP COLUMN name;"
+
+
+def test_generate_migration_of_main_table():
+    session = Session()
+    branch = create_branch("Test 6", session=session)
+    table, _, _ = create_table(branch, "test_6_table", session=session)
+    request_merge_branch(branch, session=session, test_connector=test_connector)
+    ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+
+    branch = create_branch("Test 7", session=session)
+    _, _, commit1 = create_column(branch, table, name="id", datatype="INTEGER", session=session)
+    update_table(branch, table, name="test_6_table_renamed", session=session)
+    _, _, commit2 = create_column(branch, table, name="name", datatype="TEXT", session=session)
+    test_connector.generate_migration(branch)
+    session.flush()
+
+    assert commit1.sql_up == "ALTER TABLE test_6_table ADD COLUMN id INTEGER;"
+    assert commit2.sql_up == "ALTER TABLE test_6_table_renamed ADD COLUMN name TEXT;"
+    main_sql = [commit.sql_up for commit in branch.commits if commit.branch_id != branch.id and commit.sql_up]
+    assert main_sql[0] == "CREATE TABLE test_6_table ();", "Merged commits keep SQL generated in branch"
+
+    commit1.sql_up = "-- generated"
+    test_connector.generate_migration(branch)
+    assert commit1.sql_up == "-- generated"
+
+
+def test_connector_engine_is_pooled():
+    engine = test_connector.connect()
+    assert engine is test_connector.connect()
+    assert engine is not prod_connector.connect()
+
+
+def test_failed_migration_is_rolled_back():
+    session = Session()
+    branch = create_branch("Test 8", session=session)
+    table, _, _ = create_table(branch, "test_8_table", session=session)
+    create_column(branch, table, name="id", datatype="NOT_A_TYPE", session=session)
+
+    with pytest.raises(MigrationError):
+        request_merge_branch(branch, session=session, test_connector=test_connector)
+    assert branch.type == BranchTypes.WIP
+    assert "test_8_table" not in inspect(test_connector.connect()).get_table_names()
+
+
+def test_conflicts():
+    session = Session()
+    branch = create_branch("Test 9", session=session)
+    table, _, _ = create_table(branch, "test_9_table", session=session)
+    request_merge_branch(branch, session=session, test_connector=test_connector)
+    ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+
+    branch1 = create_branch("Test 10", session=session)
+    branch2 = create_branch("Test 11", session=session)
+    branch3 = create_branch("Test 12", session=session)
+    create_column(branch1, table, name="id", datatype="INTEGER", session=session)
+    create_column(branch2, table, name="name", datatype="TEXT", session=session)
+    create_table(branch3, "test_12_table", session=session)
+    request_merge_branch(branch1, session=session, test_connector=test_connector)
+    ok_branch(branch1, session=session, test_connector=test_connector, prod_connector=prod_connector)
+
+    assert check_conflicts(branch2, session=session)
+    assert not check_conflicts(branch3, session=session)
+    with pytest.raises(MergeError):
+        request_merge_branch(branch2, session=session, test_connector=test_connector)
+
+
+def test_conflicts_with_commits_without_table():
+    session = Session()
+    branch = create_branch("Test 10 legacy", session=session)
+    table, _, _ = create_table(branch, "test_10_legacy", session=session)
+    request_merge_branch(branch, session=session, test_connector=test_connector)
+    ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+
+    branch1 = create_branch("Test 10 legacy 1", session=session)
+    branch2 = create_branch("Test 10 legacy 2", session=session)
+    create_column(branch1, table, name="id", datatype="INTEGER", session=session)
+    create_column(branch2, table, name="name", datatype="TEXT", session=session)
+    request_merge_branch(branch1, session=session, test_connector=test_connector)
+    ok_branch(branch1, session=session, test_connector=test_connector, prod_connector=prod_connector)
+    # Commits made before touched tables were stored
+    main_commit = get_branch(1, session=session).head_commit
+    session.query(Commit).filter(Commit.id == main_commit.id).update({Commit.table_id: None})
+    session.query(DbColumnAttributes).filter(DbColumnAttributes.id == main_commit.attribute_id_out).update(
+        {DbColumnAttributes.table_id: None}
+    )
+    assert not check_conflicts(branch2, session=session)
+
+    backfill(session=session)
+    assert check_conflicts(branch2, session=session)
+
+
+def test_merge_replays_commits_onto_main_head():
+    session = Session()
+    branch1 = create_branch("Test 13", session=session)
+    branch2 = create_branch("Test 14", session=session)
+    create_table(branch1, "test_13_table", session=session)
+    create_table(branch2, "test_14_table", session=session)
+    for branch in (branch1, branch2):
+        request_merge_branch(branch, session=session, test_connector=test_connector)
+        ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+
+    main = get_branch(1, session=session)
+    assert main.head_commit.dev_branch_id == branch2.id
+    log = main.commits
+    assert [commit.dev_branch_id for commit in log[:4]] == [branch2.id] * 2 + [branch1.id] * 2
+    assert log[0].sql_up == "CREATE TABLE test_14_table ();"
+
+
+def test_merge_writes_checkpoints(monkeypatch):
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_INTERVAL", 2)
+    session = Session()
+    branch = create_branch("Test 15", session=session)
+    create_table(branch, "test_15_table", [("a", "INTEGER"), ("b", "INTEGER"), ("c", "INTEGER")], session=session)
+    request_merge_branch(branch, session=session, test_connector=test_connector)
+    ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+
+    main = get_branch(1, session=session)
+    log = main.commits
+    checkpoints = session.query(SchemaCheckpoint).filter(SchemaCheckpoint.commit_id.in_([c.id for c in log[:5]])).all()
+    assert sorted(c.commit_id for c in checkpoints) == [log[3].id, log[1].id, log[0].id]
+
+    def full_replay(commit):
+        return {e: (attr.id, deleted) for e, (attr, deleted) in replay_state(commit.ancestry()).items()}
+
+    for commit in log[:5]:
+        assert checkpoint.resolve_state(commit, session=session) == full_replay(commit)
+    assert {a.id for a in get_schema(main, main.head_commit)} == {a.id for a in get_schema(main)}
+
+    child = create_branch("Test 16", session=session)
+    assert checkpoint.resolve_state(child.head_commit, session=session) == full_replay(child.head_commit)
+
+
+def test_diff():
+    session = Session()
+    branch = create_branch("Test 17", session=session)
+    table, _, _ = create_table(branch, "test_17_table", [("a", "INTEGER")], session=session)
+    request_merge_branch(branch, session=session, test_connector=test_connector)
+    ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+    main = get_branch(1, session=session)
+    branch_point = main.head_commit
+
+    child = create_branch("Test 18", session=session)
+    column = get_column(child, branch.own_commits[0].attribute_out.column_id)[0]
+    update_table(child, table, "test_17_renamed", session=session)
+    delete_column(child, column, session=session)
+    new_table, _, _ = create_table(child, "test_18_table", session=session)
+
+    assert commit_graph.common_ancestor(session, main.head_commit_id, child.head_commit_id) == branch_point.id
+    diff = get_diff(main.head_commit, child.head_commit, session=session)
+    assert diff.ancestor_id == branch_point.id
+    assert [commit.id for commit in diff.commits] == [commit.id for commit in child.own_commits]
+    assert [attr.entity_id for attr in diff.added] == [new_table.id]
+    assert [attr.entity_id for attr in diff.removed] == [column.id]
+    assert [(old.name, new.name) for old, new in diff.altered] == [("test_17_table", "test_17_renamed")]
+
+    commits = list(reversed(diff.commits))
+    sql = test_connector.generate_sql(commits, child, child.head_commit)
+    assert [up for up, _ in sql if up] == [
+        "ALTER TABLE test_17_table RENAME TO test_17_renamed;",
+        "ALTER TABLE test_17_renamed DROP COLUMN a;",
+        "CREATE TABLE test_18_table ();",
+    ]
+    assert all(commit.sql_up is None for commit in commits)
+
+
+def test_migration_plan_compacts_branch():
+    session = Session()
+    branch = create_branch("Test 23 base", session=session)
+    existing, _, _ = create_table(branch, "test_23_existing", [("a", "INTEGER"), ("b", "INTEGER")], session=session)
+    request_merge_branch(branch, session=session, test_connector=test_connector)
+    ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+    a, b = sorted(existing.columns, key=lambda column: column.id)
+
+    branch = create_branch("Test 23", session=session)
+    new, _, _ = create_table(branch, "test_23_new", [("x", "INTEGER"), ("y", "INTEGER")], session=session)
+    x, y = sorted(new.columns, key=lambda column: column.id)
+    update_table(branch, new, "test_23_new_1", session=session)
+    update_table(branch, new, "test_23_new_2", session=session)
+    create_column(branch, new, name="z", datatype="TEXT", session=session)
+    update_column(branch, y, name="y", datatype="BIGINT", session=session)
+    delete_column(branch, x, session=session)
+    temporary, _, _ = create_table(branch, "test_23_temporary", [("t", "INTEGER")], session=session)
+    delete_table(branch, temporary, session=session)
+    update_table(branch, existing, "test_23_renamed", session=session)
+    update_column(branch, a, name="a", datatype="BIGINT", session=session)
+    delete_column(branch, b, session=session)
+    create_column(branch, existing, name="c", datatype="TEXT", session=session)
+    test_connector.generate_migration(branch)
+    session.flush()
+
+    plan = test_connector.plan(branch.own_commits)
+    assert [statement.up for statement in plan] == [
+        "CREATE TABLE test_23_new_2 (y BIGINT, z TEXT);",
+        "ALTER TABLE test_23_existing RENAME TO test_23_renamed;",
+        "ALTER TABLE test_23_renamed ALTER COLUMN a TYPE BIGINT USING a::BIGINT, DROP COLUMN b, ADD COLUMN c TEXT;",
+    ]
+    assert plan[-1].down == (
+        "ALTER TABLE test_23_renamed DROP COLUMN c, ADD COLUMN b INTEGER, ALTER COLUMN a TYPE INTEGER USING a::INTEGER;"
+    )
+    assert branch.own_commits[0].sql_up == "ALTER TABLE test_23_renamed ADD COLUMN c TEXT;"
+
+    test_connector.downgrade(test_connector.upgrade(branch.own_commits))
+    columns = inspect(test_connector.connect()).get_columns("test_23_existing")
+    assert {column["name"] for column in columns} == {"a", "b"}
+    request_merge_branch(branch, session=session, test_connector=test_connector)
+    ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+    columns = inspect(prod_connector.connect()).get_columns("test_23_renamed")
+    assert [(column["name"], str(column["type"])) for column in columns] == [("a", "BIGINT"), ("c", "TEXT")]
+    assert "test_23_new_2" in inspect(prod_connector.connect()).get_table_names()
+
+
+def test_migration_plan_restores_dropped_table():
+    session = Session()
+    branch = create_branch("Test 23 drop base", session=session)
+    table, _, _ = create_table(branch, "test_23_dropped", [("a", "INTEGER"), ("b", "TEXT")], session=session)
+    request_merge_branch(branch, session=session, test_connector=test_connector)
+    ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+
+    branch = create_branch("Test 23 drop", session=session)
+    delete_table(branch, table, session=session)
+    test_connector.generate_migration(branch)
+    session.flush()
+
+    plan = test_connector.plan(branch.own_commits)
+    assert [(statement.up, statement.down) for statement in plan] == [
+        ("DROP TABLE test_23_dropped;", "CREATE TABLE test_23_dropped (a INTEGER, b TEXT);")
+    ]
+    test_connector.downgrade(test_connector.upgrade(branch.own_commits))
+    columns = inspect(test_connector.connect()).get_columns("test_23_dropped")
+    assert [(column["name"], str(column["type"])) for column in columns] == [("a", "INTEGER"), ("b", "TEXT")]
+
+
+def test_migration_plan_falls_back_on_name_collision():
+    session = Session()
+    branch = create_branch("Test 24 base", session=session)
+    first, _, _ = create_table(branch, "test_24_first", session=session)
+    request_merge_branch(branch, session=session, test_connector=test_connector)
+    ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+
+    branch = create_branch("Test 24", session=session)
+    update_table(branch, first, "test_24_second", session=session)
+    create_table(branch, "test_24_first", session=session)
+    test_connector.generate_migration(branch)
+    session.flush()
+
+    commits = [commit for commit in reversed(branch.own_commits) if commit.sql_up]
+    plan = test_connector.plan(branch.own_commits)
+    assert [statement.up for statement in plan] == [commit.sql_up for commit in commits]
+
+
+def test_group_steps_keeps_renames_alone():
+    steps = [
+        Step(StepActions.ADD_COLUMN, 1, "t", "a", "INTEGER"),
+        Step(StepActions.DROP_COLUMN, 1, "t", "b", "INTEGER"),
+        Step(StepActions.RENAME_COLUMN, 1, "t", "c", new_name="d"),
+        Step(StepActions.ALTER_COLUMN_TYPE, 1, "t", "d", "INTEGER", new_datatype="BIGINT"),
+        Step(StepActions.ADD_COLUMN, 2, "u", "a", "INTEGER"),
+    ]
+    assert group_steps(steps) == [steps[:2], [steps[2]], [steps[3]], [steps[4]]]
+
+
+def test_uncompacted_plan_groups_column_actions():
+    session = Session()
+    connector = PostgreConnector(settings.DWH_CONNECTION_TEST, compact=False)
+    branch = create_branch("Test 24 uncompacted", session=session)
+    table, _, _ = create_table(branch, "test_24_uncompacted", [("a", "INTEGER"), ("b", "INTEGER")], session=session)
+    a, b = sorted(table.columns, key=lambda column: column.id)
+    update_column(branch, a, name="a", datatype="BIGINT", session=session)
+    delete_column(branch, b, session=session)
+    c, _, _ = create_column(branch, table, name="c", datatype="TEXT", session=session)
+    delete_column(branch, c, session=session)
+    connector.generate_migration(branch)
+    session.flush()
+
+    plan = connector.plan(branch.own_commits)
+    assert [statement.up for statement in plan] == [
+        "CREATE TABLE test_24_uncompacted ();",
+        "ALTER TABLE test_24_uncompacted ADD COLUMN a INTEGER, ADD COLUMN b INTEGER;",
+        "ALTER TABLE test_24_uncompacted ALTER COLUMN a TYPE BIGINT USING a::BIGINT, DROP COLUMN b, "
+        "ADD COLUMN c TEXT;",
+        "ALTER TABLE test_24_uncompacted DROP COLUMN c;",
+    ]
+    connector.migrate(branch.own_commits, commit=False)
+
+
+def test_independent_groups_follow_tables_and_names():
+    statements = [
+        Statement("rename first", "", 1, frozenset({"a", "b"})),
+        Statement("alter second", "", 2, frozenset({"c"})),
+        Statement("create third", "", 3, frozenset({"a"})),
+        Statement("alter first", "", 1, frozenset({"b"})),
+    ]
+    assert independent_groups(statements) == [[statements[0], statements[2], statements[3]], [statements[1]]]
+    assert independent_groups(statements + [Statement("unknown", "")]) == [statements + [Statement("unknown", "")]]
+
+
+def test_parallel_migration():
+    session = Session()
+    connector = PostgreConnector(settings.DWH_CONNECTION_TEST, parallelism=3)
+    with connector.connect().connect() as connection:
+        connection.exec_driver_sql("CREATE TABLE test_25_taken ();")
+    branch = create_branch("Test 25", session=session)
+    for number in range(4):
+        create_table(branch, f"test_25_table_{number}", [("a", "INTEGER"), ("b", "TEXT")], session=session)
+    connector.generate_migration(branch)
+    session.flush()
+    assert len(connector._split(connector.plan(branch.own_commits))) == 3
+
+    connector.migrate(branch.own_commits, commit=False)
+    assert "test_25_table_0" not in inspect(connector.connect()).get_table_names()
+    connector.downgrade(connector.upgrade(branch.own_commits))
+    assert "test_25_table_0" not in inspect(connector.connect()).get_table_names()
+
+    create_table(branch, "test_25_taken", session=session)
+    connector.generate_migration(branch)
+    session.flush()
+    with pytest.raises(MigrationError):
+        connector.migrate(branch.own_commits)
+    with pytest.raises(MigrationError):
+        connector.upgrade(branch.own_commits)
+    tables = inspect(connector.connect()).get_table_names()
+    assert not any(table.startswith("test_25_table") for table in tables)
+
+
+def test_parallel_migration_commits_all_groups(monkeypatch):
+    session = Session()
+    connector = PostgreConnector(settings.DWH_CONNECTION_TEST, parallelism=2)
+    connector.check_parallelism()
+    assert connector.parallelism == 2, "max_prepared_transactions has to be enabled in test database"
+    prepared = []
+    prepare = TwoPhaseTransaction.prepare
+    monkeypatch.setattr(TwoPhaseTransaction, "prepare", lambda self: prepared.append(self.xid) or prepare(self))
+    branch = create_branch("Test 25 two phase", session=session)
+    for number in range(2):
+        create_table(branch, f"test_25_two_phase_{number}", [("a", "INTEGER")], session=session)
+    connector.generate_migration(branch)
+    session.flush()
+
+    connector.migrate(branch.own_commits)
+    assert len(prepared) == 2
+    tables = inspect(connector.connect()).get_table_names()
+    assert {"test_25_two_phase_0", "test_25_two_phase_1"} <= set(tables)
+
+
+def test_parallel_migration_without_two_phase(monkeypatch):
+    session = Session()
+    connector = PostgreConnector(settings.DWH_CONNECTION_TEST, parallelism=2)
+    monkeypatch.setattr(connector, "_supports_two_phase", lambda connection: False)
+    connector.check_parallelism()
+    assert connector.parallelism == 1
+    branch = create_branch("Test 25 serial", session=session)
+    for number in range(2):
+        create_table(branch, f"test_25_serial_{number}", [("a", "INTEGER")], session=session)
+    connector.generate_migration(branch)
+    session.flush()
+
+    connector.migrate(branch.own_commits)
+    tables = inspect(connector.connect()).get_table_names()
+    assert {"test_25_serial_0", "test_25_serial_1"} <= set(tables)
+
+
+def test_failed_commit_prepared_rolls_back_the_rest(monkeypatch):
+    session = Session()
+    connector = PostgreConnector(settings.DWH_CONNECTION_TEST, parallelism=2)
+    commit_twophase = PGDialect.do_commit_twophase
+    committed = []
+
+    def fail_second(self, connection, xid, *args, **kwargs):
+        if committed:
+            connection.invalidate()
+            raise DBAPIError("COMMIT PREPARED", None, Exception("connection lost"))
+        committed.append(xid)
+        commit_twophase(self, connection, xid, *args, **kwargs)
+
+    monkeypatch.setattr(PGDialect, "do_commit_twophase", fail_second)
+    branch = create_branch("Test 25 failed commit", session=session)
+    for number in range(2):
+        create_table(branch, f"test_25_failed_{number}", [("a", "INTEGER")], session=session)
+    connector.generate_migration(branch)
+    session.flush()
+
+    with pytest.raises(FatalMigrationError):
+        connector.migrate(branch.own_commits)
+    with connector.connect().connect() as connection:
+        assert connection.exec_driver_sql("SELECT count(*) FROM pg_prepared_xacts").scalar() == 0
+    tables = [table for table in inspect(connector.connect()).get_table_names() if table.startswith("test_25_failed")]
+    assert len(tables) == 1
+
+
+def test_backfill_heads():
+    session = Session()
+    branch = create_branch("Test 12 backfill", session=session)
+    create_table(branch, "test_12_backfill", session=session)
+    head_commit_id = branch.head_commit_id
+    session.query(Branch).filter(Branch.id == branch.id).update({Branch.head_commit_id: None})
+    session.expire_all()
+    assert get_branch(branch.id, session=session).head_commit_id is None
+
+    backfill(session=session)
+    assert get_branch(branch.id, session=session).head_commit_id == head_commit_id
+
+
+def test_backfill_states_from_commits():
+    session = Session()
+    branch = create_branch("Test 1 backfill", session=session)
+    table, _, _ = create_table(branch, "test_1_backfill", session=session)
+    column, _, _ = create_column(branch, table, name="a", datatype="INTEGER", session=session)
+    deleted, _, _ = create_column(branch, table, name="b", datatype="INTEGER", session=session)
+    update_table(branch, table, name="test_1_backfilled", session=session)
+    delete_column(branch, deleted, session=session)
+    # Branch made by older version has only chain of commits
+    session.query(BranchState).filter(BranchState.branch_id == branch.id).delete()
+    session.query(Branch).filter(Branch.id == branch.id).update({Branch.head_commit_id: None})
+    session.expire_all()
+
+    backfill(session=session)
+    branch = get_branch(branch.id, session=session)
+    assert get_table(branch, table.id)[1].name == "test_1_backfilled"
+    assert get_column(branch, column.id)[1].name == "a"
+    with pytest.raises(ColumnDeleted):
+        get_column(branch, deleted.id)
+
+
+def test_concurrent_writers_dont_fork_branch():
+    session, other_session = Session(), Session()
+    branch = create_branch("Test 12 concurrent", session=session)
+    table, _, _ = create_table(branch, "test_12_concurrent", session=session)
+    stale_head_commit_id = branch.head_commit_id
+    create_column(branch, table, name="a", datatype="INTEGER", session=session)
+    head_commit_id = branch.head_commit_id
+
+    # Other writer has read the head before the column was created
+    stale_branch = get_branch(branch.id, session=other_session)
+    set_committed_value(stale_branch, "head_commit_id", stale_head_commit_id)
+    commits_count = other_session.query(Commit).filter(Commit.branch_id == branch.id).count()
+    with pytest.raises(BranchHeadMoved):
+        create_table(stale_branch, "test_12_stale", session=other_session)
+
+    assert get_branch(branch.id, session=Session()).head_commit_id == head_commit_id
+    assert other_session.query(Commit).filter(Commit.branch_id == branch.id).count() == commits_count
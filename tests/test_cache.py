@@ -0,0 +1,19 @@
+from dbengine.routes.cache import ResponseCache, make_etag
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = ResponseCache(2)
+    cache.put(("a", 1), b"1")
+    cache.put(("b", 1), b"2")
+    assert cache.get(("a", 1)) == b"1"
+    cache.put(("c", 1), b"3")
+
+    assert len(cache) == 2
+    assert cache.get(("b", 1)) is None
+    assert cache.get(("a", 1)) == b"1"
+    assert cache.get(("c", 1)) == b"3"
+
+
+def test_etag_follows_head_commit():
+    assert make_etag("/table", (), 1, 10) == make_etag("/table", (), 1, 10)
+    assert make_etag("/table", (), 1, 10) != make_etag("/table", (), 1, 11)
@@ -0,0 +1,32 @@
+from dbengine.methods import *
+from dbengine.methods.graph import CommitGraph, commit_graph
+from . import Session
+
+
+def test_chain_matches_ancestry():
+    session = Session()
+    branch = create_branch("Test Graph 1", session=session)
+    table, table_attrs, commit = create_table(branch, "test_graph_1", [("id", "INTEGER")], session=session)
+    update_table(branch, table, "test_graph_1_renamed", session=session)
+
+    chain = commit_graph.chain(session, branch.head_commit_id)
+    assert list(chain.id) == [c.id for c in branch.commits]
+    own = commit_graph.chain(session, branch.head_commit_id, branch_id=branch.id)
+    assert list(own.id) == [c.id for c in branch.own_commits]
+
+    assert get_table(branch, table.id, start_from_commit=commit) == (table, table_attrs)
+    assert get_table(branch, table.id, start_from_commit=branch.head_commit)[1].name == "test_graph_1_renamed"
+    assert table.id in get_tables(branch)
+
+
+def test_bounded_graph_falls_back():
+    session = Session()
+    branch = create_branch("Test Graph 2", session=session)
+    create_table(branch, "test_graph_2", [("id", "INTEGER"), ("val", "INTEGER")], session=session)
+
+    graph = CommitGraph(max_size=2)
+    assert graph.chain(session, branch.head_commit_id) is None
+    assert len(graph) == 2
+    assert list(graph.chain(session, branch.head_commit_id, until_id=branch.own_commits[2].id).id) == [
+        c.id for c in branch.own_commits[:2]
+    ]
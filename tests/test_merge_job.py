@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from dbengine.exceptions import MergeJobAlreadyQueued
+from dbengine.job_runner import JobRunner
+from dbengine.methods import *
+from dbengine.models import BranchTypes, MergeJobActions, MergeJobStatuses
+from . import Session
+from . import test_connector, prod_connector
+
+
+def test_merge_job():
+    session = Session()
+    branch = create_branch("Test Job 1", session=session)
+    create_table(branch, "test_job_1", session=session)
+    job = create_merge_job(branch, MergeJobActions.REQUEST, session=session)
+    assert job.status == MergeJobStatuses.QUEUED
+
+    with pytest.raises(MergeJobAlreadyQueued):
+        create_merge_job(branch, MergeJobActions.APPROVE, session=session)
+
+    job = run_merge_job(job.id, session=session, test_connector=test_connector, prod_connector=prod_connector)
+    assert job.status == MergeJobStatuses.DONE
+    assert job.start_ts <= job.finish_ts
+    assert branch.type == BranchTypes.MR
+
+    job = create_merge_job(branch, MergeJobActions.REQUEST, session=session)
+    job = run_merge_job(job.id, session=session, test_connector=test_connector, prod_connector=prod_connector)
+    assert job.status == MergeJobStatuses.FAILED
+    assert job.error
+    assert get_merge_jobs(branch, session=session)[0] == job
+
+
+def test_unfinished_merge_jobs_fail_on_start():
+    session = Session()
+    branch = create_branch("Test Job 2", session=session)
+    create_table(branch, "test_job_2", session=session)
+    job = create_merge_job(branch, MergeJobActions.REQUEST, session=session)
+    job.status = MergeJobStatuses.RUNNING
+    session.flush()
+
+    assert fail_unfinished_merge_jobs(session=session) >= 1
+    assert job.status == MergeJobStatuses.FAILED
+    assert job.error and job.finish_ts
+    job = create_merge_job(branch, MergeJobActions.REQUEST, session=session)
+    assert job.status == MergeJobStatuses.QUEUED
+
+
+def test_job_runner_target_limit():
+    runner = JobRunner(max_workers=4, target_concurrency=1)
+    running, max_running, lock = [0], [0], threading.Lock()
+
+    def job():
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        threading.Event().wait(0.01)
+        with lock:
+            running[0] -= 1
+
+    futures = [runner.submit(job, targets=["dwh"]) for _ in range(8)]
+    for future in futures:
+        future.result()
+    runner.shutdown()
+    assert max_running[0] == 1
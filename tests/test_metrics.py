@@ -0,0 +1,25 @@
+from sqlalchemy import create_engine, text
+
+from dbengine.metrics import METADATA_TARGET, RequestStats, register_engine, request_stats
+from . import Session, engine, settings
+
+
+def test_request_stats_count_statements_by_target():
+    dwh_engine = create_engine(settings.DWH_CONNECTION_TEST)
+    register_engine(dwh_engine, "test")
+    stats = RequestStats()
+    token = request_stats.set(stats)
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+        with dwh_engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    finally:
+        request_stats.reset(token)
+        dwh_engine.dispose()
+    # Statements outside of request are not counted
+    Session().execute(text("SELECT 1"))
+
+    assert stats.statements == {METADATA_TARGET: 2, "test": 1}
+    assert stats.seconds[METADATA_TARGET] > 0
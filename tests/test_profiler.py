@@ -0,0 +1,44 @@
+import json
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from dbengine.routes import profiler
+from dbengine.routes.profiler import ProfiledRoute
+
+
+def make_client() -> TestClient:
+    router = APIRouter(prefix="/branch", route_class=ProfiledRoute)
+
+    @router.get("/{branch_id}/slow")
+    def slow(branch_id: int):
+        return sum(range(1000))
+
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_profile_written_on_request(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiler.settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiler.settings, "PROFILE_DIR", str(tmp_path))
+    client = make_client()
+
+    assert client.get("/branch/5/slow").json() == 499500
+    assert list(tmp_path.iterdir()) == []
+
+    assert client.get("/branch/5/slow", headers={"X-Profile": "1"}).json() == 499500
+    client.get("/branch/5/slow", params={"profile": "1"})
+    assert len(list(tmp_path.glob("*.prof"))) == 2
+    details = json.loads(next(tmp_path.glob("*.json")).read_text())
+    assert details["route"] == "/branch/{branch_id}/slow"
+    assert details["branch_id"] == 5
+    assert details["status_code"] == 200
+
+
+def test_profile_disabled_by_settings(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiler.settings, "PROFILING_ENABLED", False)
+    monkeypatch.setattr(profiler.settings, "PROFILE_DIR", str(tmp_path))
+
+    make_client().get("/branch/5/slow", headers={"X-Profile": "1"})
+    assert list(tmp_path.iterdir()) == []
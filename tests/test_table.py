@@ -1,7 +1,15 @@
+from datetime import datetime
+
 import pytest
 
 from dbengine.methods import *
-from dbengine.exceptions import TableDoesntExists, ColumnDoesntExists, ColumnDeleted, TableDeleted
+from dbengine.exceptions import TableDoesntExists, ColumnDoesntExists, ColumnDeleted, TableDeleted, BatchOperationError
+from dbengine.exceptions import CommitNotFoundError
+from dbengine.methods.batch import Operation
+from dbengine.methods.converters import schema_aggregator
+from dbengine.methods.state import get_column_states
+from dbengine.models import AttributeTypes, DbColumnAttributes
+from dbengine.models.branch import CommitActionTypes
 from . import Session
 from . import test_connector, prod_connector
 
@@ -141,3 +149,179 @@ def test_column_delete():
 
     assert ucommit.attribute_id_in == attrs.id
     assert ucommit.attribute_id_out is None
+
+
+def test_branch_state():
+    session = Session()
+    branch = create_branch("Test Table 7", session=session)
+    table, _, _ = create_table(branch, "test_table_7", session=session)
+    col, _, _ = create_column(branch, table, name="id", datatype="VARCHAR(256)", session=session)
+    _, utable_attr, _ = update_table(branch, table, name="upd_test_table_7", session=session)
+
+    state = get_state(branch, table.id)
+    assert state.attribute_id == utable_attr.id
+    assert not state.deleted
+
+    delete_table(branch, table, session=session)
+    assert get_state(branch, table.id).deleted
+    assert get_state(branch, col.id).deleted
+
+    request_merge_branch(branch, session=session, test_connector=test_connector)
+    ok_branch(branch, session=session, test_connector=test_connector, prod_connector=prod_connector)
+    ubranch = create_branch("Test Table 8", session=session)
+    with pytest.raises(TableDeleted):
+        get_table(ubranch, table.id)
+
+
+def test_schema():
+    session = Session()
+    branch = create_branch("Test Table 9", session=session)
+    table, _, commit = create_table(branch, "test_table_9", session=session)
+    col_1, _, _ = create_column(branch, table, name="id", datatype="VARCHAR(256)", session=session)
+    col_2, _, _ = create_column(branch, table, name="name", datatype="VARCHAR(256)", session=session)
+    delete_column(branch, col_2, session=session)
+
+    attrs = get_schema(branch)
+    assert {attr.entity_id for attr in attrs} >= {table.id, col_1.id}
+    assert col_2.id not in {attr.entity_id for attr in attrs}
+
+    attrs = get_schema(branch, start_from_commit=commit)
+    assert table.id in {attr.entity_id for attr in attrs}
+    assert col_1.id not in {attr.entity_id for attr in attrs}
+
+
+def test_create_with_columns():
+    session = Session()
+    branch = create_branch("Test Table 10", session=session)
+    columns = [(f"col_{i}", "INTEGER") for i in range(50)]
+    table, attrs, commit = create_table(branch, "test_table_10", columns, session=session)
+
+    assert attrs.name == "test_table_10"
+    assert commit.attribute_id_out == attrs.id
+    own = branch.own_commits
+    assert len(own) == len(columns) + 2
+    assert own[-2] == commit
+    assert [c.attribute_out.name for c in reversed(own[:-2])] == [name for name, _ in columns]
+    assert branch.head_commit == own[0]
+
+    col, col_attrs = get_column(branch, own[0].attribute_out.column_id)
+    assert col.table_id == table.id
+    assert col_attrs.name == "col_49"
+
+
+def test_batch():
+    session = Session()
+    branch = create_branch("Test Table 11", session=session)
+    table, _, _ = create_table(branch, "test_table_11", [("id", "INTEGER"), ("val", "INTEGER")], session=session)
+    _, col_attrs = get_column(branch, branch.own_commits[0].attribute_out.column_id)
+    head = branch.head_commit_id
+    create, alter, drop = CommitActionTypes.CREATE, CommitActionTypes.ALTER, CommitActionTypes.DROP
+    TABLE, COLUMN = AttributeTypes.TABLE, AttributeTypes.COLUMN
+
+    with pytest.raises(BatchOperationError):
+        apply_batch(
+            branch, [Operation(create, TABLE, -1, name="t"), Operation(create, COLUMN, -2, -1)], session=session
+        )
+    with pytest.raises(TableDoesntExists):
+        apply_batch(branch, [Operation(create, COLUMN, -1, table_id=-5, name="c", datatype="INTEGER")], session=session)
+    assert branch.head_commit_id == head
+
+    result = apply_batch(
+        branch,
+        [
+            Operation(create, TABLE, -1, name="test_table_11_new"),
+            Operation(create, COLUMN, -2, table_id=-1, name="id", datatype="INTEGER"),
+            Operation(alter, TABLE, table.id, name="test_table_11_renamed"),
+            Operation(alter, COLUMN, col_attrs.column_id, datatype="BIGINT"),
+            Operation(drop, TABLE, table.id),
+        ],
+        session=session,
+    )
+    assert len(result) == 5
+    own = branch.own_commits
+    assert branch.head_commit_id == own[0].id == result[-1][1]
+    # branch commit, table with two columns, four edits and table drop with its columns
+    assert len(own) == 1 + 3 + 4 + 3
+    new_table_id = result[0][0]
+    schema = {t["id"]: t for t in schema_aggregator(get_schema(branch))}
+    assert table.id not in schema
+    assert [c["name"] for c in schema[new_table_id]["columns"]] == ["id"]
+    altered = own[3].attribute_out
+    assert (altered.name, altered.datatype) == (col_attrs.name, "BIGINT")
+
+
+def test_batch_with_columns_without_table_id():
+    session = Session()
+    branch = create_branch("Test Table 11 legacy", session=session)
+    table, _, _ = create_table(branch, "test_table_11_legacy", [("a", "INTEGER")], session=session)
+    altered, dropped = (
+        create_table(branch, name, [("b", "INTEGER")], session=session)[0] for name in ("test_11_alter", "test_11_drop")
+    )
+    # Attributes written by older versions have no table_id
+    for legacy in (table, altered, dropped):
+        (state,) = get_column_states(branch, legacy.id)
+        session.query(DbColumnAttributes).filter(DbColumnAttributes.id == state.attribute_id).update(
+            {DbColumnAttributes.table_id: None}
+        )
+    session.expire_all()
+    (altered_state,) = get_column_states(branch, altered.id)
+    (dropped_state,) = get_column_states(branch, dropped.id)
+    alter, drop = CommitActionTypes.ALTER, CommitActionTypes.DROP
+
+    apply_batch(
+        branch,
+        [
+            Operation(alter, AttributeTypes.COLUMN, altered_state.entity_id, datatype="BIGINT"),
+            Operation(drop, AttributeTypes.TABLE, dropped.id),
+        ],
+        session=session,
+    )
+    altered_commit, dropped_commit, _ = branch.own_commits[2::-1]
+    assert altered_commit.table_id == altered_commit.attribute_out.table_id == altered.id
+    assert dropped_commit.table_id == dropped.id
+    with pytest.raises(ColumnDeleted):
+        get_column(branch, dropped_state.entity_id)
+    apply_batch(branch, [Operation(drop, AttributeTypes.TABLE, table.id)], session=session)
+    assert get_column_states(branch, table.id) == []
+
+
+def test_schema_at_commit_and_time():
+    session = Session()
+    branch = create_branch("Test Table 12", session=session)
+    other = create_branch("Test Table 13", session=session)
+    table, _, commit = create_table(branch, "test_table_12", session=session)
+    update_table(branch, table, "test_table_12_renamed", session=session)
+
+    assert get_commit(branch, commit.id) == commit
+    assert get_commit(branch, branch.own_commits[-1].prev_commit_id).branch_id == 1
+    with pytest.raises(CommitNotFoundError):
+        get_commit(other, commit.id)
+
+    assert get_commit_at(branch, commit.create_ts) == commit
+    assert get_commit_at(branch, branch.head_commit.create_ts) == branch.head_commit
+    with pytest.raises(CommitNotFoundError):
+        get_commit_at(branch, datetime(2000, 1, 1))
+
+    names = {attr.entity_id: attr.name for attr in get_schema(branch, get_commit_at(branch, commit.create_ts))}
+    assert names[table.id] == "test_table_12"
+    assert get_table(branch, table.id, start_from_commit=commit)[1].name == "test_table_12"
+    # Commit out of branch history means the head
+    assert get_table(branch, table.id, start_from_commit=other.head_commit)[1].name == "test_table_12_renamed"
+
+
+def test_schema_with_columns_without_table_id():
+    session = Session()
+    branch = create_branch("Test Table 3 legacy", session=session)
+    table, tab_attr, _ = create_table(branch, "test_table_3_legacy", session=session)
+    column, _, _ = create_column(branch, table, name="a", datatype="INTEGER", session=session)
+    _, attr, _ = update_column(branch, column, name="b", datatype="INTEGER", session=session)
+    # Attributes written by older versions of update_column have no table_id
+    legacy = session.query(DbColumnAttributes).filter(DbColumnAttributes.id == attr.id)
+    legacy.update({DbColumnAttributes.table_id: None})
+    session.expire_all()
+
+    columns = [state.attribute for state in get_column_states(branch, table.id)]
+    (row,) = schema_aggregator([tab_attr, *columns])
+    assert [(c["name"], c["table_id"]) for c in row["columns"]] == [("b", table.id)]
+    schema = {t["id"]: t for t in schema_aggregator(get_schema(branch))}
+    assert [c["name"] for c in schema[table.id]["columns"]] == ["b"]